@@ -0,0 +1,319 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Synthetic benchmark of the delta coverage pipeline.
+
+For every size given with --files, a scratch git repository is built with
+that many C++ files and --commits commits that each rewrite --churn of the
+lines of a sample of the files. Coverage for the last commit is written as
+gcovr-style html detail pages, a gcovr JSON report or an lcov tracefile,
+and every UTCover stage is timed on it. The timings are saved as JSON so
+that runs of different dcovr versions can be compared.
+
+example:
+    python benchmarks/bench_pipeline.py --files 100 1000 --output bench.json
+"""
+
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dcovr import increment_generator  # noqa: E402
+from dcovr.increment_generator import UTCover  # noqa: E402
+from dcovr.gcovr_html import GcovHTMLParser, scan_report  # noqa: E402
+from dcovr.gcovr_json import read_gcovr_json  # noqa: E402
+from dcovr.lcov import read_lcov_tracefiles  # noqa: E402
+from dcovr.version import __version__  # noqa: E402
+
+PREFIX = 'utcov.'
+MISSING_PREFIX = 'src/'
+
+PAGE_HEAD = '''<html>
+<body>
+<table>
+<tr><td class="headerName">File:</td>
+<td class="headerValue">%s</td></tr>
+'''
+PAGE_ROW = '''    <tr>
+    <td align="right" class="lineno"><pre>%d</pre></td>
+    <td align="right" class="linebranch"></td>
+    <td align="right" class="linecount %s"><pre>%s</pre></td>
+    <td align="left" class="src %s"><pre>%s</pre></td>
+    </tr>
+'''
+PAGE_TAIL = '''</table>
+</body>
+</html>
+'''
+
+
+def git(repo, *args):
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(('git',) + args, cwd=repo, stdout=devnull)
+
+
+def source_name(i):
+    return '%sdir%d/file%d.cpp' % (MISSING_PREFIX, i % 10, i)
+
+
+def build_repository(repo, n_files, n_lines, n_commits, churn, rnd):
+    """Create the git repository and return the content of every file."""
+    git(repo, 'init', '-q')
+    git(repo, 'config', 'user.email', 'bench@dcovr')
+    git(repo, 'config', 'user.name', 'bench')
+    contents = {}
+    for i in range(n_files):
+        contents[source_name(i)] = ['int v%d_%d = %d;' % (i, n, n)
+                                    for n in range(n_lines)]
+    write_files(repo, contents)
+    git(repo, 'add', '-A')
+    git(repo, 'commit', '-q', '-m', 'base')
+
+    for c in range(n_commits):
+        touched = rnd.sample(sorted(contents), max(1, n_files // 4))
+        for name in touched:
+            lines = contents[name]
+            for _ in range(max(1, int(len(lines) * churn))):
+                lines[rnd.randrange(len(lines))] = 'int c%d = %d;' % (
+                    c, rnd.randrange(1000))
+        write_files(repo, dict((name, contents[name]) for name in touched))
+        git(repo, 'commit', '-q', '-a', '-m', 'change %d' % c)
+    return contents
+
+
+def write_files(repo, contents):
+    for name, lines in contents.items():
+        path = os.path.join(repo, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+
+def line_kinds(contents, rnd):
+    """Draw covered/uncovered/not code for every line of every file."""
+    return dict((name, [rnd.choice(['coveredLine', 'uncoveredLine', ''])
+                        for _ in lines])
+                for name, lines in contents.items())
+
+
+def write_html_report(report_dir, contents, kinds):
+    os.makedirs(report_dir)
+    for name, lines in contents.items():
+        relname = name[len(MISSING_PREFIX):]
+        page = os.path.join(report_dir,
+                            PREFIX + relname.replace('/', '_') + '.html')
+        with open(page, 'w') as f:
+            f.write(PAGE_HEAD % relname)
+            for n, (line, kind) in enumerate(zip(lines, kinds[name]), 1):
+                f.write(PAGE_ROW % (n, kind, '1' if kind == 'coveredLine'
+                                    else '', kind, line))
+            f.write(PAGE_TAIL)
+
+
+def write_json_report(path, contents, kinds):
+    files = []
+    for name in sorted(contents):
+        files.append({
+            'file': name[len(MISSING_PREFIX):],
+            'lines': [{'line_number': n, 'count': int(kind == 'coveredLine'),
+                       'gcovr/noncode': kind == '', 'branches': []}
+                      for n, kind in enumerate(kinds[name], 1)],
+            'functions': []})
+    with open(path, 'w') as f:
+        json.dump({'gcovr/format_version': '0.3', 'files': files}, f)
+
+
+def write_lcov_report(path, repo, contents, kinds):
+    with open(path, 'w') as f:
+        for name in sorted(contents):
+            f.write('TN:\nSF:%s\n' % os.path.join(repo, name))
+            for n, kind in enumerate(kinds[name], 1):
+                if kind:
+                    f.write('DA:%d,%d\n' % (n, int(kind == 'coveredLine')))
+            f.write('end_of_record\n')
+
+
+def verify_scanner(report_dir):
+    """Check scan_report() against GcovHTMLParser on every page."""
+    for name in sorted(os.listdir(report_dir)):
+        path = os.path.join(report_dir, name)
+        fast = scan_report(path)
+        parser = GcovHTMLParser()
+        parser.feed(open(path, 'r').read())
+        if fast.covers != parser.covers or fast.uncovers != parser.uncovers:
+            raise AssertionError("scan_report() disagrees with "
+                                 "GcovHTMLParser on " + path)
+
+
+def timed(timings, stage, fn, *args):
+    start = time.time()
+    result = fn(*args)
+    timings[stage] = round(time.time() - start, 6)
+    return result
+
+
+def run_pipeline(options, repo, workdir):
+    """Run every UTCover stage on the repository and time it."""
+    report_dir = os.path.join(workdir, 'report')
+    coverage_loader = None
+    if options.input == 'json':
+        coverage_loader = partial(read_gcovr_json,
+                                  [os.path.join(workdir, 'coverage.json')])
+    elif options.input == 'lcov':
+        coverage_loader = partial(read_lcov_tracefiles,
+                                  [os.path.join(workdir, 'coverage.info')])
+    if not os.path.isdir(report_dir):
+        os.makedirs(report_dir)
+
+    ut = UTCover('HEAD~%d' % options.commits, 'HEAD', report_dir, PREFIX,
+                 MISSING_PREFIX, 0.0, engine=options.engine,
+                 jobs=options.jobs, coverage_loader=coverage_loader)
+    timings = {}
+    cwd = os.getcwd()
+    os.chdir(repo)
+    # the pipeline's progress messages would drown the results
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        src_files = timed(timings, 'get_changed_files', ut.get_changed_files)
+        timed(timings, 'load_coverage_index', ut.load_coverage, src_files)
+        changes = timed(timings, 'get_changed_lines', ut.get_changed_lines,
+                        src_files)
+        lcov_changes, uncovers = timed(timings, 'get_recoverage_info',
+                                       ut.get_recoverage_info, changes)
+        details = dict((f, (len(v), len(v) - len(uncovers.get(f, ())), v))
+                       for f, v in lcov_changes.items())
+        timed(timings, 'create_coverage_trs', ut.create_coverage_trs, details)
+        # create_report() renders the table rows again
+        timed(timings, 'create_report', ut.create_report, lcov_changes,
+              uncovers)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+    timings['total'] = round(sum(timings.values()), 6)
+    return timings, len(src_files), sum(len(v) for v in changes.values())
+
+
+def bench_size(options, n_files, rnd):
+    workdir = tempfile.mkdtemp(prefix='dcovr-bench-')
+    try:
+        repo = os.path.join(workdir, 'repo')
+        os.makedirs(repo)
+        start = time.time()
+        contents = build_repository(repo, n_files, options.lines,
+                                    options.commits, options.churn, rnd)
+        kinds = line_kinds(contents, rnd)
+        if options.input == 'html':
+            write_html_report(os.path.join(workdir, 'report'),
+                              contents, kinds)
+            if options.verify:
+                verify_scanner(os.path.join(workdir, 'report'))
+        elif options.input == 'json':
+            write_json_report(os.path.join(workdir, 'coverage.json'),
+                              contents, kinds)
+        else:
+            write_lcov_report(os.path.join(workdir, 'coverage.info'),
+                              repo, contents, kinds)
+        setup = round(time.time() - start, 3)
+
+        runs = []
+        for _ in range(options.repeat):
+            runs.append(run_pipeline(options, repo, workdir))
+        # keep the fastest run of every stage
+        timings = dict((stage, min(run[0][stage] for run in runs))
+                       for stage in runs[0][0])
+        return {'files': n_files,
+                'changed_files': runs[0][1],
+                'changed_lines': runs[0][2],
+                'setup_seconds': setup,
+                'stages': timings}
+    finally:
+        if options.keep:
+            sys.stderr.write("kept %s\n" % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def create_argument_parser():
+    parser = ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument("--files", type=int, nargs='+', default=[10, 100],
+                        help="Number of files of each benchmarked size. "
+                             "Default: %(default)s.")
+    parser.add_argument("--lines", type=int, default=500,
+                        help="Lines per file. Default: %(default)s.")
+    parser.add_argument("--commits", type=int, default=5,
+                        help="Commits in the delta. Default: %(default)s.")
+    parser.add_argument("--churn", type=float, default=0.05,
+                        help="Fraction of the lines of a touched file "
+                             "rewritten by a commit. Default: %(default)s.")
+    parser.add_argument("--input", choices=['html', 'json', 'lcov'],
+                        default='html',
+                        help="Coverage input. Default: %(default)s.")
+    parser.add_argument("--changed-lines", choices=['diff', 'blame'],
+                        dest='engine', default='diff',
+                        help="Changed lines engine. Default: %(default)s.")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="--jobs of dcovr. Default: %(default)s.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Runs per size; the fastest one is kept. "
+                             "Default: %(default)s.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed. Default: %(default)s.")
+    parser.add_argument("--verify", action="store_true",
+                        help="Check the html scanner against "
+                             "GcovHTMLParser on the generated pages.")
+    parser.add_argument("--keep", action="store_true",
+                        help="Keep the scratch directories.")
+    parser.add_argument("-o", "--output", default=None,
+                        help="Write the results to this JSON file "
+                             "instead of stdout.")
+    return parser
+
+
+def main(args=None):
+    options = create_argument_parser().parse_args(args)
+    increment_generator.DEBUG = 0
+    rnd = random.Random(options.seed)
+
+    results = []
+    for n_files in options.files:
+        results.append(bench_size(options, n_files, rnd))
+        sys.stderr.write("%d files: %s\n" % (
+            n_files, json.dumps(results[-1]['stages'], sort_keys=True)))
+
+    doc = {
+        'dcovr_version': __version__,
+        'python': platform.python_version(),
+        'params': {'lines': options.lines, 'commits': options.commits,
+                   'churn': options.churn, 'input': options.input,
+                   'engine': options.engine, 'jobs': options.jobs,
+                   'repeat': options.repeat, 'seed': options.seed},
+        'results': results,
+    }
+    text = json.dumps(doc, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -30,9 +30,12 @@
 import os
 import sys
 
+from multiprocessing import cpu_count
+
 from argparse import ArgumentParser, ArgumentTypeError
 
 from .utils import (Logger)
+from .cache import default_cache_dir
 from .version import __version__
 from .increment_generator import generate_delta_report
 
@@ -49,6 +52,24 @@ def check_percentage(value):
     return x
 
 
+# helper for --path-alias
+def path_alias(value):
+    alias, sep, target = value.partition('=')
+    if not sep or not alias or not target:
+        raise ArgumentTypeError(
+            "{value} is not a FROM=TO alias".format(value=value))
+    return alias, target
+
+
+# helper for --range
+def commit_range(value):
+    since, sep, until = value.partition('..')
+    if not sep or not since or not until or until.startswith('.'):
+        raise ArgumentTypeError(
+            "{value} is not a SINCE..UNTIL range".format(value=value))
+    return since, until
+
+
 def create_argument_parser():
     """Create the argument parser."""
 
@@ -90,12 +111,16 @@ def create_argument_parser():
     options.add_argument(
         "-r", "--report-dir",
         help="The root directory of your gcovr report files. "
-             "Defaults to '%(default)s', the current directory. "
+             "Defaults to '.', the current directory. "
              "File names are reported relative to this root. "
-             "The --root is the default --filter.",
-        action="store",
+             "The --root is the default --filter. "
+             "Can be given several times, or as a glob pattern, "
+             "to merge the reports of test shards: a line is covered "
+             "if any of them covered it. The summary is then written "
+             "in the first directory, without the annotated pages.",
+        action="append",
         dest="source_report_dir",
-        default='.'
+        default=None
     )
     options.add_argument(
         "--since",
@@ -111,6 +136,44 @@ def create_argument_parser():
         dest="until",
         default=None
     )
+    options.add_argument(
+        "--range",
+        help="Evaluate the commit range SINCE..UNTIL. Can be given "
+             "several times to evaluate many ranges in one run, with "
+             "one summary per range, --since..--until included. The "
+             "changed lines of every range are carried to the report "
+             "at --report-commit or --until; without them, the ranges "
+             "must all end at the same commit.",
+        action="append",
+        type=commit_range,
+        dest="ranges",
+        default=[]
+    )
+    options.add_argument(
+        "--each-commit",
+        help="Evaluate --since..--until as a whole and every commit "
+             "in it on its own, from the diff of the commit with its "
+             "first parent. The lines of a commit are carried to the "
+             "report at --until (or --report-commit); those a later "
+             "commit changed again are counted as unknown. "
+             "Can be combined with --range.",
+        action="store_true",
+        dest="each_commit",
+        default=False
+    )
+    options.add_argument(
+        "--report-commit",
+        help="The commit the coverage report was built at, when it is "
+             "older than --until, like a nightly report. The changed lines "
+             "are carried back to it through the diff from this commit "
+             "to --until; the lines that diff changed too are unknown "
+             "to the report and are left out of the coverage, but counted. "
+             "The files renamed since this commit are looked up in the "
+             "report by their old path. Defaults to --until.",
+        action="store",
+        dest="report_commit",
+        default=None
+    )
     options.add_argument(
         "--prefix",
         help="The prefix of the gcovr file",
@@ -125,6 +188,141 @@ def create_argument_parser():
         dest="missing_prefix_dir",
         default="src/"
     )
+    inputs = options.add_mutually_exclusive_group()
+    inputs.add_argument(
+        "--gcovr-json",
+        help="Read the line coverage from this gcovr --json output "
+             "(optionally gzipped) instead of the html report pages. "
+             "Paths in it are relative to the gcovr root, like the "
+             "report page names. Can be given several times.",
+        action="append",
+        dest="gcovr_json",
+        default=[]
+    )
+    inputs.add_argument(
+        "--lcov",
+        help="Read the line coverage from this lcov .info tracefile "
+             "(optionally gzipped) instead of the html report pages. "
+             "Can be given several times.",
+        action="append",
+        dest="lcov",
+        default=[]
+    )
+    inputs.add_argument(
+        "--gcov-build-dir",
+        help="Run gcov on the .gcda files of this build directory "
+             "that belong to the changed files, instead of reading "
+             "a gcovr report.",
+        action="store",
+        dest="gcov_build_dir",
+        default=None
+    )
+    options.add_argument(
+        "--exclude-directories",
+        help="Skip the directories of --gcov-build-dir matching this "
+             "regular expression while looking for .gcda files. "
+             "Can be given several times.",
+        action="append",
+        dest="exclude_dirs",
+        default=[]
+    )
+    options.add_argument(
+        "--path-alias",
+        help="Read the source paths under FROM in --gcovr-json, --lcov "
+             "or gcov data as if they were under TO, for example "
+             "--path-alias=/sandbox/1234/src=/home/me/repo/src. "
+             "The longest matching FROM wins. Can be given several times.",
+        action="append",
+        type=path_alias,
+        dest="path_aliases",
+        default=[]
+    )
+    options.add_argument(
+        "--gcov-executable",
+        help="Use a particular gcov executable with --gcov-build-dir. "
+             "Default: %(default)s.",
+        action="store",
+        dest="gcov_cmd",
+        default="gcov"
+    )
+    options.add_argument(
+        "-f", "--filter",
+        help="Keep only the changed files matching this regular "
+             "expression. Relative filters are matched against the "
+             "path relative to the current directory, absolute ones "
+             "against the real path. Can be given several times; "
+             "a file is kept if any filter matches. "
+             "Defaults to all the changed files.",
+        action="append",
+        dest="filter",
+        default=[]
+    )
+    options.add_argument(
+        "-e", "--exclude",
+        help="Leave out the changed files matching this regular "
+             "expression, like --filter. Can be given several times.",
+        action="append",
+        dest="exclude",
+        default=[]
+    )
+    options.add_argument(
+        "--changed-lines",
+        help="How to find the changed lines. "
+             "'diff' takes the lines added or modified between "
+             "--since and --until from one git diff. "
+             "'blame' takes the lines whose last commit, according to "
+             "git blame, is in the range; this is much slower. "
+             "Default: %(default)s.",
+        choices=["diff", "blame"],
+        dest="changed_lines",
+        default="diff"
+    )
+    options.add_argument(
+        "-j", "--jobs",
+        help="Set the number of threads or processes to use in parallel "
+             "for git blame, gcov and the report pages. "
+             "Defaults to %(default)s; -j without a number uses "
+             "the number of CPUs.",
+        nargs="?",
+        const=cpu_count(),
+        type=int,
+        dest="jobs",
+        default=1
+    )
+
+    cache_options = parser.add_argument_group(
+        "Cache Options",
+        description="The changed lines are cached on disk, keyed by "
+                    "the commit and blob SHAs they were computed from. "
+                    "Parsed report pages are cached too, keyed by "
+                    "the path, size, mtime and inode of the page, "
+                    "when they are not annotated anyway. The entries "
+                    "are plain JSON; the compiled templates are only "
+                    "kept when nobody else can write to the cache."
+    )
+    cache_options.add_argument(
+        "--no-cache",
+        help="Do not read or write the cache.",
+        action="store_false",
+        dest="cache",
+        default=True
+    )
+    cache_options.add_argument(
+        "--cache-dir",
+        help="Keep the cache in this directory. "
+             "Default: %(default)s.",
+        action="store",
+        dest="cache_dir",
+        default=default_cache_dir()
+    )
+    cache_options.add_argument(
+        "--cache-size",
+        help="Drop the least recently used entries when the cache "
+             "grows over this many megabytes. Default: %(default)s.",
+        type=int,
+        dest="cache_size",
+        default=256
+    )
 
     output_options = parser.add_argument_group(
         "Output Options",
@@ -145,6 +343,58 @@ def create_argument_parser():
         dest="relative_anchors",
         default=True
     )
+    output_options.add_argument(
+        "--format",
+        help="Write the summary as a html page in the report directory, "
+             "or as a small JSON document with the totals, the gate "
+             "result and the numbers of every file, to --output or "
+             "increment_coverage_report.json in the report directory. "
+             "The paged format writes a html page of a fixed size and "
+             "the numbers of every file and directory in a compact "
+             "data file next to it, which the page renders with "
+             "pagination, sorting and directory folding: use it for "
+             "very large changes. "
+             "The json format implies --summary-only. "
+             "Default: %(default)s.",
+        choices=["html", "paged", "json"],
+        dest="output_format",
+        default="html"
+    )
+    output_options.add_argument(
+        "--gzip-data",
+        help="Gzip the data file of the paged format. The page then "
+             "fetches it, so it has to be served over http.",
+        action="store_true",
+        dest="gzip_data",
+        default=False
+    )
+    output_options.add_argument(
+        "--summary-only",
+        help="Only compute the numbers: do not write the new_*.html "
+             "copies of the report pages with the changed lines marked. "
+             "Dcovr then exits with status 1 if the coverage of a range "
+             "misses the threshold, like with the json format.",
+        action="store_true",
+        dest="summary_only",
+        default=False
+    )
+    output_options.add_argument(
+        "--profile",
+        help="Record the wall and CPU time, subprocess count, "
+             "bytes read and written and file count of every stage, "
+             "write them to this JSON file, and summarize them "
+             "with --verbose.",
+        action="store",
+        dest="profile",
+        default=None
+    )
+    output_options.add_argument(
+        "--cprofile",
+        help="Dump a cProfile profile of the whole run to this file.",
+        action="store",
+        dest="cprofile",
+        default=None
+    )
     output_options.add_argument(
         "-s", "--print-summary",
         help="Print a small report to stdout "
@@ -185,16 +435,21 @@ def main(args=None):
     if options.output is not None:
         options.output = os.path.abspath(options.output)
 
-    if options.since is None:
+    if options.since is None and (options.each_commit or not options.ranges):
         logger.error("please input the 'since' commit")
         sys.exit(0)
-    if options.until is None:
+    if options.until is None and (options.each_commit or not options.ranges):
         logger.error("please input the 'until' commit")
         sys.exit(0)
-    if options.source_report_dir is None:
-        logger.error("please input the gcov report dir")
-        sys.exit(0)
-    if options.prefix is None:
+    if options.ranges and options.since is not None and options.until is None:
+        parser.error("--since needs --until")
+    if options.ranges and options.report_commit is None and options.until is None and \
+            len(set(until for _, until in options.ranges)) > 1:
+        # the ranges are all carried to the commit of the single report
+        parser.error("the ranges end at different commits: "
+                     "give the commit of the report with --report-commit or --until")
+    if options.prefix is None and not (options.gcovr_json or options.lcov or
+                                       options.gcov_build_dir):
         logger.error("please input the 'prefix' of gcovr report file")
         sys.exit(0)
     if options.missing_prefix_dir is None:
@@ -205,7 +460,7 @@ def main(args=None):
             "until commit {until_commit}\n"
             "gcovr report prefix {gcovr_prefix}\n"
             "gcovr missing prefix {gcovr_missingg_prefx}\n",
-            html_dir=options.source_report_dir,
+            html_dir=", ".join(options.source_report_dir or ["."]),
             since_commit=options.since,
             until_commit=options.until,
             gcovr_prefix=options.prefix,
@@ -0,0 +1,102 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+An on-disk cache of results that are expensive to compute again.
+
+Every entry is a small JSON file named after the hash of its key: the
+cache may live on storage other users write to, and reading an entry must
+not run their code, as unpickling would. A hit bumps the entry's
+modification time, and prune() drops the least recently used entries once
+the cache grows over its size cap.
+"""
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+
+
+def default_cache_dir():
+    """Return $XDG_CACHE_HOME/dcovr, or ~/.cache/dcovr."""
+    base = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'dcovr')
+
+
+class DiskCache(object):
+    """
+    directory: where the entries are stored
+    max_size: the size cap of the cache, in bytes
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_CACHE_SIZE):
+        # the keys hash differently from one major Python version to the other
+        self.directory = os.path.join(directory, 'py%d' % sys.version_info[0])
+        self.max_size = max_size
+        self.dirty = False
+
+    def entry_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest[2:])
+
+    def get(self, key):
+        """Return the value stored for ``key``, or None."""
+        path = self.entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                stored_key, value = json.load(f)
+            os.utime(path, None)
+        except Exception:
+            return None
+        # the key went through JSON too: tuples came back as lists
+        return value if stored_key == json.loads(json.dumps(key)) else None
+
+    def set(self, key, value):
+        """
+        Store ``value`` for ``key``, both made of JSON types (tuples come
+        back as lists). Errors only cost a cache miss.
+        """
+        path = self.entry_path(key)
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w') as f:
+                json.dump([key, value], f, separators=(',', ':'))
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return
+        self.dirty = True
+
+    def prune(self):
+        """Remove the least recently used entries above the size cap."""
+        if not self.dirty:
+            return
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self.dirty = False
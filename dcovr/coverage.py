@@ -0,0 +1,97 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+import gzip
+import os
+
+from .lineset import LineSet
+
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class LineCoverage(object):
+    """
+    The LineSets of covered and uncovered lines of one source file.
+
+    It offers the same ``covers``/``uncovers``/``close()`` interface as
+    the HTML parser, so the report readers can be used interchangeably.
+    """
+
+    def __init__(self, covers=None, uncovers=None):
+        self.covers = covers if covers is not None else LineSet()
+        self.uncovers = uncovers if uncovers is not None else LineSet()
+
+    def close(self):
+        pass
+
+
+class SourceResolver(object):
+    """
+    Map the source paths found in coverage data onto the changed files.
+
+    src_files: the changed files, relative to the git root
+    missing_prefix_dir: the part of the git path missing from the
+        relative paths of the coverage data, e.g. 'src/'
+    root: the git root that absolute paths are made relative to
+    aliaser: a utils.PathAliaser mapping the source roots of the build
+        (sandboxes, bind mounts...) onto the work tree, or None
+    """
+
+    def __init__(self, src_files, missing_prefix_dir='', root=None,
+                 aliaser=None):
+        self.src_files = set(src_files)
+        self.missing_prefix_dir = missing_prefix_dir or ''
+        self.root = root if root is not None else os.getcwd()
+        self.aliaser = aliaser
+
+    def resolve(self, path, base=None):
+        """
+        Return the changed file that ``path`` refers to, or None.
+
+        Relative paths are taken relative to ``base`` when it is given.
+        """
+        if base is not None:
+            path = os.path.join(base, path)
+        if self.aliaser is not None:
+            path, _, _ = self.aliaser.master_path(os.path.normpath(path))
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.root)
+        path = os.path.normpath(path).replace(os.path.sep, '/')
+        if path in self.src_files:
+            return path
+        path = self.missing_prefix_dir + path
+        if path in self.src_files:
+            return path
+        return None
+
+
+def open_maybe_gzipped(path):
+    """Open a file for binary reading, decompressing it if it is gzipped."""
+    with open(path, 'rb') as f:
+        magic = f.read(len(GZIP_MAGIC))
+    if magic == GZIP_MAGIC:
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def build_line_coverage(counts):
+    """Turn a dict of {line number: execution count} into a LineCoverage."""
+    covers, uncovers = LineSet(), LineSet()
+    for lineno in sorted(counts):
+        if counts[lineno] > 0:
+            covers.add(lineno)
+        else:
+            uncovers.add(lineno)
+    return LineCoverage(covers, uncovers)
+
+
+def merge_line_coverage(a, b):
+    """
+    Merge the LineCoverage of one file in two reports: a line is covered
+    if either report covered it.
+    """
+    covers = a.covers | b.covers
+    return LineCoverage(covers, (a.uncovers | b.uncovers) - covers)
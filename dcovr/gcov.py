@@ -0,0 +1,170 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Run gcov on the translation units of the changed files only.
+
+The ``.gcda`` files of a build directory are matched against the names of
+the changed files, and gcov runs on those alone, several at a time, each in
+its own scratch directory. Its JSON (gcc >= 9) or text intermediate format
+output is read straight into line coverage.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+from multiprocessing.pool import ThreadPool
+
+from .coverage import build_line_coverage, open_maybe_gzipped
+from .profiling import PROFILER
+from .utils import Logger, search_file
+
+
+def gcov_supports_json(gcov_cmd):
+    """Tell whether gcov has the --json-format option (gcc >= 9)."""
+    PROFILER.count('subprocesses')
+    try:
+        output = subprocess.check_output(
+            [gcov_cmd, '--help'], stderr=subprocess.STDOUT,
+            universal_newlines=True)
+    except (OSError, subprocess.CalledProcessError):
+        return False
+    return '--json-format' in output
+
+
+def gcda_source_names(gcda):
+    """
+    Yield the names of the source file a ``.gcda`` file may belong to:
+    ``foo`` or ``foo.cpp`` for ``foo.gcda`` and ``foo.cpp.gcda``, and also
+    what follows every dash of ``prog-foo.gcda``, which gcc >= 11 writes
+    for ``gcc --coverage -o prog foo.cpp``.
+    """
+    base = os.path.basename(gcda)[:-len('.gcda')]
+    yield base
+    i = base.find('-')
+    while i >= 0:
+        yield base[i + 1:]
+        i = base.find('-', i + 1)
+
+
+def find_gcda_files(build_dir, src_files, exclude_dirs=(), jobs=1):
+    """
+    Return the ``.gcda`` files of ``build_dir`` that belong to one of the
+    ``src_files`` by name, and have their ``.gcno`` next to them. The
+    directories matching one of the ``exclude_dirs`` filters are skipped,
+    and up to ``jobs`` directories are listed at the same time.
+
+    The ``foo.gcda`` (make), ``foo.cpp.gcda`` (CMake) and ``prog-foo.gcda``
+    (gcc >= 11 compiling and linking in one step) schemes are recognized.
+    A warning names every file of ``src_files`` without a ``.gcda`` file:
+    its lines would count as uncovered.
+    """
+    names = {}
+    for f in src_files:
+        name = os.path.basename(f)
+        names.setdefault(name, []).append(f)
+        names.setdefault(os.path.splitext(name)[0], []).append(f)
+    # the .gcno files come from the same walk: no stat per .gcda file
+    found = set(search_file(r'.*\.gc(da|no)$', build_dir, exclude_dirs, jobs))
+    gcda_files = []
+    matched = set()
+    for gcda in found:
+        if not gcda.endswith('.gcda') or gcda[:-len('.gcda')] + '.gcno' not in found:
+            continue
+        owners = [name for name in gcda_source_names(gcda) if name in names]
+        if owners:
+            gcda_files.append(gcda)
+            for name in owners:
+                matched.update(names[name])
+    for f in src_files:
+        if f not in matched:
+            Logger().warn("no .gcda file for {} in {}: its changed lines count as uncovered",
+                          f, build_dir)
+    return sorted(gcda_files)
+
+
+def iter_json_lines(path):
+    """Yield ``(source, base, line, count)`` from a .gcov.json.gz file."""
+    with open_maybe_gzipped(path) as f:
+        data = json.loads(f.read().decode('utf-8'))
+    base = data.get('current_working_directory')
+    for entry in data['files']:
+        for line in entry['lines']:
+            yield entry['file'], base, line['line_number'], line['count']
+
+
+def iter_text_lines(path):
+    """Yield ``(source, base, line, count)`` from a gcov -i .gcov file."""
+    source = None
+    with open(path, 'r') as f:
+        for line in f:
+            if line.startswith('file:'):
+                source = line[len('file:'):].rstrip('\n')
+            elif line.startswith('lcount:') and source is not None:
+                # lcount:<line number>,<execution count>[,<unexecuted block>]
+                fields = line[len('lcount:'):].split(',')
+                yield source, None, int(fields[0]), int(fields[1])
+
+
+def run_gcov(gcov_cmd, use_json, gcda):
+    """
+    Run gcov on one ``.gcda`` file in a scratch directory and return the
+    ``(source, base, line, count)`` tuples of its output.
+    """
+    workdir = tempfile.mkdtemp(prefix='dcovr-gcov-')
+    try:
+        cmd = [gcov_cmd, '--json-format' if use_json else '-i',
+               '--preserve-paths',
+               '--object-directory', os.path.dirname(gcda), gcda]
+        PROFILER.count('subprocesses')
+        with open(os.devnull, 'w') as devnull:
+            subprocess.call(cmd, cwd=workdir, stdout=devnull, stderr=devnull)
+        records = []
+        for name in os.listdir(workdir):
+            path = os.path.join(workdir, name)
+            PROFILER.count('bytes_read', os.path.getsize(path))
+            if name.endswith('.gcov.json.gz'):
+                records.extend(iter_json_lines(path))
+            elif name.endswith('.gcov'):
+                records.extend(iter_text_lines(path))
+        return records
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def read_gcov_coverage(build_dir, resolver, gcov_cmd='gcov', jobs=1,
+                       exclude_dirs=()):
+    """
+    Build a dict mapping every changed file compiled in ``build_dir`` to
+    its LineCoverage, running gcov on up to ``jobs`` ``.gcda`` files at
+    the same time.
+    """
+    gcda_files = find_gcda_files(build_dir, resolver.src_files, exclude_dirs,
+                                 jobs)
+    PROFILER.count('files', len(gcda_files))
+    use_json = gcov_supports_json(gcov_cmd)
+
+    def gcov(gcda):
+        return run_gcov(gcov_cmd, use_json, gcda)
+
+    pool = ThreadPool(max(1, jobs))
+    try:
+        results = pool.map(gcov, gcda_files)
+    finally:
+        pool.close()
+        pool.join()
+
+    counts = {}
+    for records in results:
+        for source, base, lineno, count in records:
+            f = resolver.resolve(source, base)
+            if f is None:
+                continue
+            file_counts = counts.setdefault(f, {})
+            file_counts[lineno] = file_counts.get(lineno, 0) + count
+    return dict((f, build_line_coverage(c)) for f, c in counts.items())
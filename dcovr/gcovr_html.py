@@ -0,0 +1,360 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Read the line coverage out of the gcovr HTML detail pages.
+"""
+
+import mmap
+import os
+import re
+
+# os.scandir is new in Python 3.5
+try:
+    from os import scandir
+except ImportError:
+    scandir = None
+
+# HTMLParser was renamed in Python 3
+try:
+    from HTMLParser import HTMLParser
+except ImportError:
+    from html.parser import HTMLParser
+
+from .coverage import LineCoverage
+from .lineset import LineSet
+from .profiling import PROFILER
+
+# The header of a detail page names its source file, relative to the gcovr root:
+#
+#   <tr><td class="headerName">File:</td>
+#   <td class="headerValue">dir1/func.cpp</td></tr>
+FILE_HEADER = re.compile(
+    br'class="headerName">File:</td>\s*<td class="headerValue">([^<]*)</td>')
+HEADER_BYTES = 64 * 1024
+
+# Every line row of a gcovr detail page looks like:
+#
+#   <td align="right" class="lineno"><pre>130</pre></td>
+#   <td align="right" class="linebranch"></td>
+#   <td align="right" class="linecount coveredLine"><pre>40</pre></td>
+#
+# The row group is optional so that a 'lineno' cell in any other layout
+# still matches, and tells scan_report() to give up on the page.
+LINE_ROW = re.compile(
+    br'class="lineno"'
+    br'(?:><pre>(\d+)</pre></td>\s*'
+    br'<td[^>]*class="linebranch"[^>]*>[^<]*(?:<(?!/td>)[^<]*)*</td>\s*'
+    br'<td[^>]*class="linecount ?(coveredLine|uncoveredLine)?")?')
+
+
+class GcovHTMLParser(HTMLParser):
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.uncovers = LineSet()
+        self.covers = LineSet()
+        self.islineNum = False
+        self.meet_lineno_tag = False
+        self.lineNum = 0
+        self.example = '''
+//未覆盖的行
+    <tr>
+    <td align="right" class="lineno"><pre>164</pre></td>
+    <td align="right" class="linebranch"></td>
+    <td align="right" class="linecount uncoveredLine"><pre></pre></td>
+    <td align="left" class="src uncoveredLine"><pre>            assert((size_t)bean.bean_index_in_slice_ &lt; chunk.recalled_do_slice_list_[bean.slice_index_in_chunk_].beans_.size());</pre></td>
+    </tr>
+
+#覆盖的行
+    <tr>
+    <td align="right" class="lineno"><pre>130</pre></td>
+    <td align="right" class="linebranch"></td>
+    <td align="right" class="linecount coveredLine"><pre>40</pre></td>
+    <td align="left" class="src coveredLine"><pre>        int index_in_reacalled_do_info = 0;</pre></td>
+    </tr>
+
+#不需要计算的行
+    <tr>
+    <td align="right" class="lineno"><pre>169</pre></td>
+    <td align="right" class="linebranch"></td>
+    <td align="right" class="linecount "><pre></pre></td>
+    <td align="left" class="src "><pre>}</pre></td>
+    </tr>
+
+    <tr>
+    <td align="right" class="lineno"><pre>170</pre></td>
+    <td align="right" class="linebranch"></td>
+    <td align="right" class="linecount "><pre></pre></td>
+    <td align="left" class="src "><pre></pre></td>
+    </tr>
+'''
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "td":
+            for a in attrs:
+                if a == ('class', 'lineno'):
+                    self.islineNum = True
+                if a == ('class', 'linecount uncoveredLine'):
+                    self.uncovers.add(self.lineNum)
+                if a == ('class', 'linecount coveredLine'):
+                    self.covers.add(self.lineNum)
+        if tag == "pre":
+            self.meet_lineno_tag = True
+
+    def handle_data(self, data):
+        if self.meet_lineno_tag and self.islineNum:
+            try:
+                self.lineNum = int(data)
+            except:
+                self.lineNum = -1
+
+    def handle_endtag(self, tag):
+        if tag == "td":
+            self.islineNum = False
+        if tag == "pre":
+            self.meet_lineno_tag = False
+
+
+def map_report(path):
+    """Memory map a report page, or return b'' when it is empty."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        PROFILER.count('files')
+        PROFILER.count('bytes_read', size)
+        if size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def parse_report(path):
+    report_parser = GcovHTMLParser()
+    report_parser.feed(open(path, 'r').read())
+    return report_parser
+
+
+def scan_report(path):
+    """
+    Return the coverage of a gcovr detail page.
+
+    The page is memory mapped and scanned with a bytes regex, so it is
+    never decoded as a whole. Pages whose layout is not recognized are
+    handed to GcovHTMLParser.
+    """
+    data = map_report(path)
+    try:
+        covers, uncovers = LineSet(), LineSet()
+        for m in LINE_ROW.finditer(data):
+            lineno, linecount = m.groups()
+            if lineno is None:
+                break
+            if linecount == b'coveredLine':
+                covers.add(int(lineno))
+            elif linecount == b'uncoveredLine':
+                uncovers.add(int(lineno))
+        else:
+            return LineCoverage(covers, uncovers)
+    finally:
+        if data:
+            data.close()
+    return parse_report(path)
+
+
+def report_cache_key(path):
+    """Identify a report page by its (path, size, mtime, inode)."""
+    st = os.stat(path)
+    return ('gcovr_html', os.path.abspath(path), st.st_size,
+            getattr(st, 'st_mtime_ns', st.st_mtime), st.st_ino)
+
+
+def cache_report(cache, key, report):
+    cache.set(key, [report.covers.to_ranges(), report.uncovers.to_ranges()])
+
+
+def scan_report_cached(path, cache):
+    """
+    Return the coverage of a gcovr detail page, looking it up in ``cache``
+    first by the identity (path, size, mtime, inode) of the page.
+    """
+    key = report_cache_key(path)
+    cached = cache.get(key)
+    if cached is not None:
+        return LineCoverage(LineSet.from_ranges(cached[0]),
+                            LineSet.from_ranges(cached[1]))
+    report = scan_report(path)
+    cache_report(cache, key, report)
+    return report
+
+
+# the changed lines are marked in the lineno cell of their row:
+#   <td align="right" class="lineno" style="background:red"><pre>NN  130</pre></td>
+LINENO_CELL = b'class="lineno"><pre>'
+CHANGED_LINENO_CELL = b'class="lineno" style="background:red"><pre>NN  '
+WRITE_CHUNK = 1024 * 1024
+
+
+def copy_range(out, data, start, end):
+    """Write data[start:end] to out without copying it all at once."""
+    while start < end:
+        chunk_end = min(end, start + WRITE_CHUNK)
+        out.write(data[start:chunk_end])
+        start = chunk_end
+
+
+def annotate_rows(data, output_path, changed_lines):
+    """
+    Copy ``data`` to ``output_path``, marking the rows of the measurable
+    ``changed_lines``, and return their coverage. Return None if a row
+    is not recognized.
+    """
+    covers, uncovers = LineSet(), LineSet()
+    last = 0
+    with open(output_path, 'wb') as out:
+        for m in LINE_ROW.finditer(data):
+            lineno, linecount = m.groups()
+            if lineno is None:
+                return None
+            if linecount is None:
+                continue
+            lineno = int(lineno)
+            if linecount == b'coveredLine':
+                covers.add(lineno)
+            else:
+                uncovers.add(lineno)
+            if lineno in changed_lines:
+                copy_range(out, data, last, m.start())
+                out.write(CHANGED_LINENO_CELL)
+                last = m.start() + len(LINENO_CELL)
+        copy_range(out, data, last, len(data))
+        PROFILER.count('bytes_written', out.tell())
+    return LineCoverage(covers, uncovers)
+
+
+def annotate_lines(path, output_path, changed_lines):
+    """Line by line fallback of annotate_rows() for unrecognized pages."""
+    lineno_cell = re.compile(r'<td align="right" class="lineno"><pre>(\d+)</pre></td>')
+    with open(path, 'r') as src:
+        with open(output_path, 'w') as out:
+            for line in src:
+                m = lineno_cell.search(line)
+                if m and int(m.group(1)) in changed_lines:
+                    line = line.replace('class="lineno"', 'class="lineno" style="background:red"')
+                    line = line.replace('<pre>', '<pre>NN  ')
+                out.write(line)
+
+
+def annotate_report(path, output_path, changed_lines):
+    """
+    Copy a gcovr detail page to ``output_path`` with the measurable
+    ``changed_lines`` marked, and return the coverage of the page.
+
+    The coverage is collected and the copy written in the same pass over
+    the memory mapped page.
+    """
+    changed_lines = LineSet(changed_lines)
+    data = map_report(path)
+    try:
+        report = annotate_rows(data, output_path, changed_lines)
+    finally:
+        if data:
+            data.close()
+    if report is None:
+        report = parse_report(path)
+        measurable = (report.covers | report.uncovers) & changed_lines
+        annotate_lines(path, output_path, measurable)
+    return report
+
+
+def convert_filepath_coverage_filename(filepath,
+        skip_prefix,
+        append_prefix,
+        postfix):
+    # @filepath: full path of a file, such as 'src/dir1/dir1_1/func.cpp'
+    filepath = filepath[len(skip_prefix):]
+    filepath = filepath.replace("/", "_")
+    gcovrfile = append_prefix + filepath + postfix
+    return gcovrfile
+
+
+def list_report_pages(report_dir, prefix):
+    """Return the names of the detail pages of ``report_dir``, in one listing."""
+    if scandir is not None:
+        entries = scandir(report_dir)
+        try:
+            return [entry.name for entry in entries
+                    if entry.name.startswith(prefix) and
+                    entry.name.endswith('.html') and entry.is_file()]
+        finally:
+            # the iterator only has close() from Python 3.6 on
+            getattr(entries, 'close', lambda: None)()
+    return [name for name in os.listdir(report_dir)
+            if name.startswith(prefix) and name.endswith('.html')]
+
+
+def read_page_header(path):
+    """Return the source file named in the header of a detail page, or None."""
+    with open(path, 'rb') as f:
+        head = f.read(HEADER_BYTES)
+    PROFILER.count('files')
+    PROFILER.count('bytes_read', len(head))
+    m = FILE_HEADER.search(head)
+    if m is None:
+        return None
+    value = m.group(1).decode('utf-8', 'replace').strip()
+    return value.replace('&lt;', '<').replace('&gt;', '>').replace('&amp;', '&')
+
+
+class ReportIndex(object):
+    """
+    The detail pages of a gcovr report directory, listed once.
+
+    gcovr names the page of 'dir1/dir1_1/func.cpp' '<prefix>dir1_dir1_1_func.cpp.html',
+    so 'a/b_c.cpp' and 'a_b/c.cpp' share a page. Such names are looked up in
+    the header of the page, which holds the real path.
+
+    report_dir: the gcovr report directory
+    prefix: the prefix of the page names
+    missing_prefix_dir: the part of the git paths missing from the gcovr paths
+    """
+
+    def __init__(self, report_dir, prefix, missing_prefix_dir):
+        self.report_dir = report_dir
+        self.prefix = prefix
+        self.missing_prefix_dir = missing_prefix_dir
+        self.pages = set(list_report_pages(report_dir, prefix))
+        # key is filename, value is the name of its page
+        self.files = {}
+        # key is a page name claimed by several files, value is these files
+        self.collisions = {}
+
+    def page_name(self, f):
+        return convert_filepath_coverage_filename(f,
+                self.missing_prefix_dir, self.prefix, ".html")
+
+    def build(self, src_files, tree_files=()):
+        """
+        Find the page of every file of ``src_files``. The names claimed by
+        several of ``src_files`` and ``tree_files`` (the source files of the
+        tree the report was built from) go by the header of the page.
+        """
+        claims = {}
+        for f in set(src_files) | set(tree_files):
+            if f.startswith(self.missing_prefix_dir):
+                claims.setdefault(self.page_name(f), set()).add(f)
+        self.collisions = dict((name, sorted(files)) for name, files in claims.items()
+                               if len(files) > 1 and name in self.pages)
+        for f in src_files:
+            name = self.page_name(f)
+            if name not in self.pages:
+                continue
+            if name in self.collisions:
+                header = read_page_header(os.path.join(self.report_dir, name))
+                if header != f[len(self.missing_prefix_dir):]:
+                    continue
+            self.files[f] = name
+
+    def lookup(self, f):
+        """Return the name of the page of a built file, or None."""
+        return self.files.get(f)
@@ -0,0 +1,68 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Read the line coverage out of the JSON written by ``gcovr --json``.
+
+The file entries are streamed one at a time with ijson when it is
+installed, and only the entries of changed files are kept.
+"""
+
+import json
+import os
+
+# ijson is optional: without it the document is loaded at once
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from .coverage import build_line_coverage, open_maybe_gzipped
+from .profiling import PROFILER
+from .utils import Logger
+
+
+def iter_gcovr_json_files(path):
+    """Yield the file entries of a gcovr JSON report."""
+    with open_maybe_gzipped(path) as f:
+        if ijson is not None:
+            for entry in ijson.items(f, 'files.item'):
+                yield entry
+        else:
+            for entry in json.loads(f.read().decode('utf-8'))['files']:
+                yield entry
+
+
+def is_code_line(line):
+    return not (line.get('gcovr/noncode', line.get('noncode', False)) or
+                line.get('gcovr/excluded', False))
+
+
+def read_gcovr_json(paths, resolver):
+    """
+    Build a dict mapping every changed file found in the gcovr JSON
+    reports ``paths`` to its LineCoverage.
+
+    A line reported by several entries is covered if any of them ran it.
+    """
+    if ijson is None:
+        Logger().warn("ijson is not installed: every gcovr JSON report is "
+                      "loaded at once. Install dcovr[json] to stream them.")
+    counts = {}
+    for path in paths:
+        PROFILER.count('files')
+        PROFILER.count('bytes_read', os.path.getsize(path))
+        for entry in iter_gcovr_json_files(path):
+            f = resolver.resolve(entry['file'])
+            if f is None:
+                continue
+            file_counts = counts.setdefault(f, {})
+            for line in entry['lines']:
+                if not is_code_line(line):
+                    continue
+                lineno = line['line_number']
+                file_counts[lineno] = file_counts.get(lineno, 0) + line['count']
+    return dict((f, build_line_coverage(c)) for f, c in counts.items())
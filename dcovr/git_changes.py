@@ -0,0 +1,421 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Compute the lines changed between two commits from ``git diff`` hunks.
+
+A single ``git diff -U0`` over the whole commit range is streamed and only
+its hunk headers are looked at, so the cost does not depend on the number
+of changed files or on the length of their history.
+
+The blame engine restricts ``git blame`` to the line ranges of those hunks
+and blames several files at the same time.
+
+A LineMap carries the line numbers of a newer revision back to an older
+one through the hunks of the diff between them, so that a report built at
+the older revision can be read at the newer one.
+
+The lines of every file are yielded as soon as they are known, so that
+the reports can be read while git is still running.
+
+Both results can be memoized in a DiskCache, keyed by the resolved commit
+and blob SHAs, so that a rewritten history never hits a stale entry.
+"""
+
+import re
+import subprocess
+from bisect import bisect_right
+from multiprocessing.pool import ThreadPool
+
+from .lineset import LineSet
+from .profiling import PROFILER
+
+# @@ -<old_start>[,<old_count>] +<new_start>[,<new_count>] @@
+HUNK_HEADER = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+# <sha> <line in original file> <line in final file>[ <lines in group>]
+BLAME_HEADER = re.compile(r'([0-9a-f]{40,64}) \d+ (\d+)')
+
+
+def git_command(*args):
+    """Build a git command line that reports paths verbatim."""
+    return ['git', '-c', 'core.quotepath=off'] + list(args)
+
+
+def iter_diff_hunks(lines):
+    """
+    Parse the output of ``git diff -U0 --no-prefix``.
+
+    Yield a ``(path, old_start, old_count, new_start, new_count)`` tuple
+    for every hunk, where ``path`` is the file name on the new side.
+    Hunks of deleted files are skipped.
+    """
+    path = None
+    in_header = False
+    for line in lines:
+        if line.startswith('diff --git '):
+            path = None
+            in_header = True
+        elif line.startswith('@@'):
+            in_header = False
+            if path is None:
+                continue
+            m = HUNK_HEADER.match(line)
+            if not m:
+                continue
+            old_start, old_count, new_start, new_count = m.groups()
+            yield (path,
+                   int(old_start), 1 if old_count is None else int(old_count),
+                   int(new_start), 1 if new_count is None else int(new_count))
+        elif in_header and line.startswith('+++ '):
+            # git terminates names containing blanks with a TAB
+            path = line[4:].rstrip('\r\n').rstrip('\t')
+            if path == '/dev/null':
+                path = None
+
+
+def iter_diff_files(lines):
+    """
+    Parse the output of ``git diff -U0 --no-prefix -M``.
+
+    Yield an ``(old_path, new_path, hunks)`` tuple for every file, where
+    ``hunks`` is the list of its ``(old_start, old_count, new_start,
+    new_count)`` hunks. ``old_path`` differs from ``new_path`` for a
+    renamed file and is None for an added one. Deleted files are skipped.
+    """
+    old_path = new_path = None
+    hunks = []
+    in_header = False
+    for line in lines:
+        if line.startswith('diff --git '):
+            if new_path is not None:
+                yield old_path, new_path, hunks
+            old_path = new_path = None
+            hunks = []
+            in_header = True
+        elif line.startswith('@@'):
+            in_header = False
+            m = HUNK_HEADER.match(line)
+            if new_path is None or not m:
+                continue
+            old_start, old_count, new_start, new_count = m.groups()
+            hunks.append((int(old_start),
+                          1 if old_count is None else int(old_count),
+                          int(new_start),
+                          1 if new_count is None else int(new_count)))
+        elif not in_header:
+            continue
+        elif line.startswith('rename from '):
+            old_path = line[len('rename from '):].rstrip('\r\n')
+        elif line.startswith('rename to '):
+            new_path = line[len('rename to '):].rstrip('\r\n')
+        elif line.startswith('--- ') or line.startswith('+++ '):
+            # git terminates names containing blanks with a TAB
+            path = line[4:].rstrip('\r\n').rstrip('\t')
+            if path == '/dev/null':
+                path = None
+            if line.startswith('--- '):
+                old_path = path
+            else:
+                new_path = path
+    if new_path is not None:
+        yield old_path, new_path, hunks
+
+
+def stream_diff(since, until, pathspecs=(), options=()):
+    """Run one ``git diff -U0`` for ``since..until`` and yield its lines."""
+    cmd = git_command('diff', '-U0', '--no-color', '--no-ext-diff',
+                      '--no-prefix')
+    cmd += list(options) + [since, until]
+    if pathspecs:
+        cmd += ['--'] + list(pathspecs)
+    PROFILER.count('subprocesses')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    try:
+        for line in proc.stdout:
+            yield line
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def stream_diff_hunks(since, until, pathspecs=()):
+    """Run one ``git diff -U0`` for ``since..until`` and yield its hunks."""
+    return iter_diff_hunks(stream_diff(since, until, pathspecs))
+
+
+def iter_diff_changed_lines(since, until, src_files, pathspecs=()):
+    """
+    Yield a ``(path, lines)`` pair for every file of ``src_files``, where
+    ``lines`` is the LineSet of its added or modified lines in ``until``.
+
+    A file is yielded as soon as the diff moves on to the next one, so
+    that its lines can be used while git is still running.
+    """
+    pending = set(src_files)
+    path, lines = None, None
+    for hunk_path, _, _, new_start, new_count in stream_diff_hunks(
+            since, until, pathspecs):
+        if hunk_path != path:
+            if lines is not None:
+                yield path, lines
+            path = hunk_path
+            lines = LineSet() if path in pending else None
+            pending.discard(path)
+        if lines is not None:
+            lines.add_range(new_start, new_count)
+    if lines is not None:
+        yield path, lines
+    # files without hunks, e.g. a mode change
+    for f in src_files:
+        if f in pending:
+            yield f, LineSet()
+
+
+def get_changed_hunks(since, until, src_files, pathspecs=()):
+    """
+    Return a dict mapping every file of ``src_files`` to the list of
+    ``(new_start, new_count)`` line ranges that the diff touched in
+    ``until``. Pure deletions have no lines in ``until`` and are dropped.
+    """
+    hunks = dict((f, []) for f in src_files)
+    for path, _, _, new_start, new_count in stream_diff_hunks(
+            since, until, pathspecs):
+        ranges = hunks.get(path)
+        if ranges is not None and new_count > 0:
+            ranges.append((new_start, new_count))
+    return hunks
+
+
+class LineMap(object):
+    """
+    hunks: the ``(old_start, old_count, new_start, new_count)`` hunks of
+    the diff of a file from an old revision to a new one, in order
+    old_path: the path of the file in the old revision, None if it is not
+    there
+    """
+
+    def __init__(self, hunks=(), old_path=None):
+        self.old_path = old_path
+        # the lines of the new revision that the diff added or modified
+        self.changed = LineSet.from_ranges(
+            (new_start, new_count) for _, _, new_start, new_count in hunks)
+        # the lines from bounds[i] on are shifted by deltas[i] in the old one
+        self.bounds = []
+        self.deltas = []
+        delta = 0
+        for _, old_count, new_start, new_count in hunks:
+            delta += old_count - new_count
+            # a pure deletion comes after its new_start line
+            self.bounds.append(new_start + (new_count or 1))
+            self.deltas.append(delta)
+
+    def map(self, lines):
+        """
+        Split the LineSet ``lines`` of the new revision. Return the LineSet
+        of the lines carried over from the old revision, numbered as in the
+        old one, and the LineSet of the lines changed since then.
+        """
+        unknown = lines & self.changed
+        carried = LineSet()
+        bounds, deltas = self.bounds, self.deltas
+        for start, end in (lines - self.changed).ranges():
+            i = bisect_right(bounds, start)
+            while start < end:
+                stop = min(end, bounds[i]) if i < len(bounds) else end
+                carried.add_range(start + (deltas[i - 1] if i else 0),
+                                  stop - start)
+                start = stop
+                i += 1
+        return carried, unknown
+
+
+def get_line_maps(old, new, src_files, pathspecs=()):
+    """
+    Return a dict mapping every file of ``src_files`` to the LineMap of
+    its lines from ``new`` back to ``old``, from one ``git diff -U0 -M``.
+    A renamed file is mapped to its old path, and a file missing in
+    ``old`` is changed as a whole.
+    """
+    line_maps = dict((f, LineMap((), f)) for f in src_files)
+    for old_path, new_path, hunks in iter_diff_files(
+            stream_diff(old, new, pathspecs, ['-M'])):
+        if new_path in line_maps:
+            line_maps[new_path] = LineMap(hunks, old_path)
+    return line_maps
+
+
+def get_range_commit_list(since, until):
+    """Return the full SHAs of the commits in ``since..until``, oldest first."""
+    PROFILER.count('subprocesses')
+    output = subprocess.check_output(
+        git_command('rev-list', '--reverse', '%s..%s' % (since, until)),
+        universal_newlines=True)
+    return output.split()
+
+
+def get_range_commits(since, until):
+    """Return the set of full SHAs of the commits in ``since..until``."""
+    return set(get_range_commit_list(since, until))
+
+
+def blame_ranges(until, path, ranges):
+    """
+    Blame the ``(start, count)`` line ranges of ``path`` at ``until`` and
+    return a ``(sha, line)`` pair for every line, or nothing if git fails.
+    """
+    if not ranges:
+        return []
+    cmd = git_command('blame', '--porcelain')
+    cmd += ['-L%d,%d' % (start, start + count - 1) for start, count in ranges]
+    cmd += [until, '--', path]
+    PROFILER.count('subprocesses')
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                            universal_newlines=True)
+    blamed = []
+    for line in proc.stdout:
+        m = BLAME_HEADER.match(line)
+        if m:
+            blamed.append((m.group(1), int(m.group(2))))
+    proc.stdout.close()
+    if proc.wait() != 0:
+        return []
+    return blamed
+
+
+def blame_lines(until, path, ranges, commits):
+    """
+    Blame the ``(start, count)`` line ranges of ``path`` at ``until`` and
+    return the LineSet of the lines whose commit is in ``commits``.
+    """
+    lines = LineSet()
+    for sha, lineno in blame_ranges(until, path, ranges):
+        if sha in commits:
+            lines.add(lineno)
+    return lines
+
+
+def iter_blame_changed_lines(since, until, src_files, pathspecs=(), jobs=1):
+    """
+    Yield a ``(path, lines)`` pair for every file of ``src_files``, where
+    ``lines`` is the LineSet of its lines in ``until`` whose last commit
+    is in ``since..until``, in the order the blames finish.
+
+    Only the ranges touched by the diff are blamed, and up to ``jobs``
+    files are blamed at the same time.
+    """
+    commits = get_range_commits(since, until)
+    hunks = get_changed_hunks(since, until, src_files, pathspecs)
+
+    def blame(f):
+        return f, blame_lines(until, f, hunks[f], commits)
+
+    # the blames count in the section of the calling thread
+    pool = ThreadPool(max(1, jobs), PROFILER.thread_initializer())
+    try:
+        for result in pool.imap_unordered(blame, src_files):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def get_tree_files(until):
+    """Return the paths of all the files of the ``until`` tree."""
+    # ls-tree takes path prefixes, not pathspecs: filter the result instead
+    cmd = git_command('ls-tree', '-r', '--name-only', '-z', until)
+    PROFILER.count('subprocesses')
+    output = subprocess.check_output(cmd, universal_newlines=True)
+    return [path for path in output.split('\0') if path]
+
+
+def get_toplevel():
+    """Return the absolute path of the root of the current git work tree."""
+    PROFILER.count('subprocesses')
+    output = subprocess.check_output(
+        git_command('rev-parse', '--show-toplevel'), universal_newlines=True)
+    return output.strip()
+
+
+def resolve_commits(*refs):
+    """Return the full SHA of the commit each of ``refs`` names."""
+    PROFILER.count('subprocesses')
+    output = subprocess.check_output(
+        git_command('rev-parse') +
+        ['%s^{commit}' % ref for ref in refs],
+        universal_newlines=True)
+    return output.split()
+
+
+def get_blob_ids(since, until, pathspecs=()):
+    """
+    Return a dict mapping every file changed in ``until`` to the
+    ``(old_blob, new_blob)`` SHAs of its two versions.
+    """
+    cmd = git_command('diff', '--raw', '--no-abbrev', '-z', since, until)
+    if pathspecs:
+        cmd += ['--'] + list(pathspecs)
+    PROFILER.count('subprocesses')
+    output = subprocess.check_output(cmd, universal_newlines=True)
+    blobs = {}
+    fields = iter(output.split('\0'))
+    for header in fields:
+        if not header.startswith(':'):
+            continue
+        # :<old mode> <new mode> <old blob> <new blob> <status>
+        _, _, old_blob, new_blob, status = header[1:].split(' ')
+        path = next(fields)
+        if status[0] in 'RC':
+            path = next(fields)
+        blobs[path] = (old_blob, new_blob)
+    return blobs
+
+
+def iter_changed_lines(engine, since, until, src_files, pathspecs=(),
+                       jobs=1):
+    if engine == 'blame':
+        return iter_blame_changed_lines(since, until, src_files, pathspecs,
+                                        jobs)
+    return iter_diff_changed_lines(since, until, src_files, pathspecs)
+
+
+def iter_cached_changed_lines(engine, since, until, src_files, cache,
+                              pathspecs=(), jobs=1):
+    """
+    Like iter_changed_lines(), but look the result of every file up in
+    ``cache`` first and only run git for the misses. The hits are
+    yielded first.
+
+    The diff result of a file only depends on its two blobs, so it is
+    shared by every range with the same file versions. A blame result is
+    keyed by (since, until, path, blob).
+    """
+    since, until = resolve_commits(since, until)
+    blobs = get_blob_ids(since, until, pathspecs)
+    keys = {}
+    for f in src_files:
+        if f not in blobs:
+            continue
+        old_blob, new_blob = blobs[f]
+        if engine == 'blame':
+            keys[f] = ('blame', since, until, f, new_blob)
+        else:
+            keys[f] = ('diff', old_blob, new_blob)
+
+    missing = []
+    for f in src_files:
+        lines = cache.get(keys[f]) if f in keys else None
+        if lines is None:
+            missing.append(f)
+        else:
+            yield f, LineSet.from_ranges(lines)
+    if missing:
+        for f, lines in iter_changed_lines(engine, since, until, missing,
+                                           pathspecs, jobs):
+            if f in keys:
+                cache.set(keys[f], lines.to_ranges())
+            yield f, lines
@@ -3,281 +3,694 @@
 
 import sys, os, re
 import json
+import glob
+import gzip
 import commands
 import time
-from HTMLParser import HTMLParser
+import cProfile
+from functools import partial
+from multiprocessing import Pool
 from pprint import *
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
+
+from .git_changes import (iter_changed_lines, iter_cached_changed_lines, get_range_commit_list,
+        get_toplevel, get_tree_files, get_line_maps)
+from .gcovr_html import (GcovHTMLParser, ReportIndex, convert_filepath_coverage_filename,
+        scan_report, scan_report_cached, annotate_report)
+from .gcovr_json import read_gcovr_json
+from .lcov import read_lcov_tracefiles
+from .gcov import read_gcov_coverage
+from .coverage import SourceResolver, merge_line_coverage
+from .cache import DiskCache
+from .profiling import PROFILER, init_worker
+from .stats import StatsTable
+from .utils import Logger, FilterSet, PathAliaser, build_filter, prefetch
 
 DEBUG = 1
 
-def convert_filepath_coverage_filename(filepath,
-        skip_prefix,
-        append_prefix,
-        postfix):
-    # @filepath: full path of a file, such as 'src/dir1/dir1_1/func.cpp'
-    filepath = filepath[len(skip_prefix):]
-    filepath = filepath.replace("/", "_")
-    gcovrfile = append_prefix + filepath + postfix
-    return gcovrfile
-
-
-def templates():
-    templates_path = os.path.join(os.path.dirname(__file__), 'templates')
-    return Environment(loader=FileSystemLoader(templates_path), autoescape=False, trim_blocks=True)
-
-
-class GcovHTMLParser(HTMLParser):
-    def __init__(self):
-        HTMLParser.__init__(self)
-        self.uncovers = []
-        self.covers = []
-        self.islineNum = False
-        self.meet_lineno_tag = False
-        self.lineNum = 0
-        self.example = '''
-//未覆盖的行
-    <tr>
-    <td align="right" class="lineno"><pre>164</pre></td>
-    <td align="right" class="linebranch"></td>
-    <td align="right" class="linecount uncoveredLine"><pre></pre></td>
-    <td align="left" class="src uncoveredLine"><pre>            assert((size_t)bean.bean_index_in_slice_ &lt; chunk.recalled_do_slice_list_[bean.slice_index_in_chunk_].beans_.size());</pre></td>
-    </tr>
-
-#覆盖的行
-    <tr>
-    <td align="right" class="lineno"><pre>130</pre></td>
-    <td align="right" class="linebranch"></td>
-    <td align="right" class="linecount coveredLine"><pre>40</pre></td>
-    <td align="left" class="src coveredLine"><pre>        int index_in_reacalled_do_info = 0;</pre></td>
-    </tr>
-
-#不需要计算的行
-    <tr>
-    <td align="right" class="lineno"><pre>169</pre></td>
-    <td align="right" class="linebranch"></td>
-    <td align="right" class="linecount "><pre></pre></td>
-    <td align="left" class="src "><pre>}</pre></td>
-    </tr>
-
-    <tr>
-    <td align="right" class="lineno"><pre>170</pre></td>
-    <td align="right" class="linebranch"></td>
-    <td align="right" class="linecount "><pre></pre></td>
-    <td align="left" class="src "><pre></pre></td>
-    </tr>
-'''
-
-    def handle_starttag(self, tag, attrs):
-        if tag == "td":
-            for a in attrs:
-                if a == ('class', 'lineno'):
-                    self.islineNum = True
-                if a == ('class', 'linecount uncoveredLine'):
-                    self.uncovers.append(self.lineNum)
-                if a == ('class', 'linecount coveredLine'):
-                    self.covers.append(self.lineNum)
-        if tag == "pre":
-            self.meet_lineno_tag = True
-
-    def handle_data(self, data):
-        if self.meet_lineno_tag and self.islineNum:
+# extensions of the source files taken into account
+SOURCE_EXTENSIONS = ['c', 'cpp']
+SOURCE_PATHSPECS = ['*.' + ext for ext in SOURCE_EXTENSIONS]
+
+# the jinja2 environment shared by every report, created by the first templates() call.
+_templates_env = None
+
+
+def templates(bytecode_dir=None):
+    # @bytecode_dir: where to cache the compiled templates across runs.
+    global _templates_env
+    if _templates_env is None:
+        templates_path = os.path.join(os.path.dirname(__file__), 'templates')
+        bytecode_cache = None
+        if bytecode_dir is not None:
             try:
-                self.lineNum = int(data)
-            except:
-                self.lineNum = -1
+                if not os.path.isdir(bytecode_dir):
+                    os.makedirs(bytecode_dir, 0o700)
+                # the compiled templates are code: only load them from a directory nobody else writes to
+                st = os.stat(bytecode_dir)
+                if st.st_uid == os.getuid() and not st.st_mode & 0o022:
+                    bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+            except OSError:
+                pass
+        # the templates are installed with the package: no need to check them for changes.
+        _templates_env = Environment(loader=FileSystemLoader(templates_path), autoescape=False, trim_blocks=True,
+                auto_reload=False, bytecode_cache=bytecode_cache)
+    return _templates_env
 
-    def handle_endtag(self, tag):
-        if tag == "td":
-            self.islineNum = False
-        if tag == "pre":
-            self.meet_lineno_tag = False
 
 class UTCover(object) :
-    def __init__(self, since_commit, until_commit, report_dir, prefix, missing_prefix_dir, thresh, monitor="{}") :
+    def __init__(self, since_commit, until_commit, report_dir, prefix, missing_prefix_dir, thresh, monitor="{}", engine="diff", jobs=1, coverage_loader=None, cache=None,
+            details=True, output_format="html", output=None, shard_dirs=(),
+            filters=None, excludes=None, aliaser=None, report_commit=None, gzip_data=False) :
         self.since = since_commit
         self.until = until_commit
         self.monitor = json.loads(monitor)
         self.report_dir = report_dir
+        # @shard_dirs: more report dirs, of other test shards: a line is covered if any report covered it.
+        # the summary is written in report_dir.
+        self.report_dirs = [report_dir] + list(shard_dirs)
         self.missing_prefix_dir = missing_prefix_dir
         self.prefix = prefix
+        # @filters, @excludes: utils.FilterSet of the changed files to keep or to leave out.
+        self.filters = filters
+        self.excludes = excludes
+        # @aliaser: a utils.PathAliaser for the source paths of the coverage_loader.
+        self.aliaser = aliaser
         self.thresh = float(thresh)
+        # 'diff': lines added or modified in since..until
+        # 'blame': lines whose last commit is in since..until
+        self.engine = engine
+        self.jobs = jobs
+        # @coverage_loader: a callable taking a SourceResolver and returning a map,
+        # key is filename, value is its LineCoverage. It replaces the html report pages.
+        self.coverage_loader = coverage_loader
+        self.coverage_index = None
+        # @cache: a DiskCache of the changed lines and parsed report pages, or None.
+        self.cache = cache
+        # the ReportIndex of every report dir, when the coverage comes from their html pages.
+        self.report_indexes = []
+        self.report_pages = None
+        # key is filename, value is the name of its annotated report page.
+        self.detail_pages = {}
+        # @details: write the annotated copies of the report pages.
+        # a page of one shard does not show the merged coverage: no copies with shards.
+        self.details = details and not shard_dirs
+        # @output_format: 'html' for increment_coverage_report.html in the report dir,
+        # 'paged' for the same page rendered by the browser from a data file next to it,
+        # 'json' for a small summary in @output (or increment_coverage_report.json).
+        self.output_format = output_format
+        self.output = output
+        # @gzip_data: gzip the data file of the paged format.
+        self.gzip_data = gzip_data
+        # the name of the summary file, without its extension.
+        self.report_name = 'increment_coverage_report'
+        # the json summaries of the ranges of check_ranges, written together at the end.
+        self.summaries = None
+        # whether the last report of create_report passed the threshold.
+        self.passed = None
+        # @report_commit: the commit the coverage was measured at, when it is not 'until'.
+        # the changed lines are carried back to it through the report_commit..until diff.
+        self.report_commit = report_commit
+        # key is a (report commit, commit the changed lines are numbered at) pair, value is a map
+        # from filename to LineMap.
+        self.line_maps = {}
+        # the commit the changed lines of the current range are carried to, or None.
+        self.carried_to = None
+        # key is filename, value is the LineSet of its changed lines that the diff to carried_to
+        # changed too: the report does not know them.
+        self.unknown_lines = {}
+        # the number of changed lines carried to carried_to.
+        self.carried_linenum = 0
+        # key is filename, value is its path at report_commit, or None if it is not there.
+        self.report_paths = {}
+        # key is (since, until, files), value is the map of changed lines of get_changed_lines,
+        # shared by the ranges of check_ranges with or without the disk cache.
+        self.changed_lines_memo = {}
 
     # get the changed files from 'since' to 'until': the cpp file. the relative path to git repo root.
     def get_changed_files(self):
         # self.since, self.until, self.monitor
+        PROFILER.count('subprocesses')
         satus, output = commands.getstatusoutput("git diff --name-only %s %s" %(self.since, self.until))
         src_files = [f for f in output.split('\n')
-                        if os.path.splitext(f)[1][1:] in ['c', 'cpp']]
+                        if os.path.splitext(f)[1][1:] in SOURCE_EXTENSIONS and self.is_included(f)]
         if DEBUG:
             pprint("<<<< The changed files begin:")
             pprint(src_files)
             pprint(">>>> The changed files end:")
         return src_files
 
+    # whether the changed file @f passes the --filter and --exclude options.
+    def is_included(self, f):
+        if self.filters and not self.filters.match(f):
+            return False
+        return not (self.excludes and self.excludes.match(f))
+
     # 获取每个文件改动的行号:在最新版本中的行号
     def get_changed_lines(self, src_files):
-        # self.since, self.until
-        changes = {}
+        key = (self.since, self.until, tuple(src_files))
+        if key in self.changed_lines_memo:
+            return dict(self.changed_lines_memo[key])
         if DEBUG:
-            pprint("<<<< The changed lines(unused lines included) begin:")
-        for f in src_files:
-            satus, output = commands.getstatusoutput("git log --oneline %s..%s %s | awk '{print $1}'" %(self.since, self.until, f))
-            commits = output.split('\n')
-            pprint("contains commits:")
-            pprint(commits)
-            cmd = "git blame %s | grep -E '(%s)' | awk  -F' *|)' '{print $6}'" %(f, '|'.join(commits))
-            pprint("getting changed lines by %s" % (cmd))
-            satus, lines = commands.getstatusoutput(cmd)
-            changes[f] = [ int(i) for i in lines.split('\n') if i.isdigit() ]
+            pprint("<<<< The changed lines(%s) begin:" % self.engine)
+        changes = dict(self.iter_changed_lines(src_files))
+        if DEBUG:
+            pprint(">>>> The changed lines end.")
+        self.changed_lines_memo[key] = changes
+        return dict(changes)
+
+    # yield (filename, changed lines) for every file of @src_files, as soon as git is done with it.
+    def iter_changed_lines(self, src_files):
+        # self.since, self.until, self.engine
+        if self.cache is not None:
+            changes = iter_cached_changed_lines(self.engine, self.since, self.until,
+                    src_files, self.cache, SOURCE_PATHSPECS, self.jobs)
+        else:
+            changes = iter_changed_lines(self.engine, self.since, self.until,
+                    src_files, SOURCE_PATHSPECS, self.jobs)
+        for f, lines in changes:
             if DEBUG:
-                print("File:", f, " || changed lines:", changes[f])
+                print("File:", f, " || changed lines:", lines)
+            yield f, lines
+
+    # @changes: an iterable of (filename, changed lines) numbered at commit @until.
+    # yield the changed lines that the @report_commit..@until diff left alone, numbered like the report,
+    # and keep those it touched in self.unknown_lines.
+    def remap_changed_lines(self, changes, src_files, until, report_commit):
+        self.carried_to = report_commit
+        line_maps = self.get_line_maps(src_files, until, report_commit)
+        for f, lines in changes:
+            carried, unknown = line_maps[f].map(lines)
+            self.carried_linenum += len(carried)
+            if unknown:
+                self.unknown_lines[f] = unknown
+                if DEBUG:
+                    print("File:", f, " || changed since the report commit:", unknown)
+            yield f, carried
+
+    # the LineMap from @until to @report_commit of every file of @src_files, from one diff per pair.
+    def get_line_maps(self, src_files, until, report_commit):
+        line_maps = self.line_maps.setdefault((report_commit, until), {})
+        missing = [f for f in src_files if f not in line_maps]
+        if missing:
+            line_maps.update(get_line_maps(report_commit, until, missing, SOURCE_PATHSPECS))
+        return line_maps
+
+    # the path of the changed file @f in the report: its path at report_commit, None if it was not there.
+    def report_path(self, f):
+        return self.report_paths.get(f, f)
 
+    # load the coverage of the changed files when it does not come from html report pages.
+    def load_coverage_index(self, src_files):
+        if self.coverage_loader is None:
+            return
+        # the coverage data knows the files by their path in the report
+        files = dict((self.report_path(f), f) for f in src_files if self.report_path(f) is not None)
+        resolver = SourceResolver(sorted(files), self.missing_prefix_dir, get_toplevel(), self.aliaser)
+        self.coverage_index = dict((files[path], coverage)
+                for path, coverage in self.coverage_loader(resolver).items())
         if DEBUG:
-            pprint(">>>> The changed lines end.")
-        return changes
+            pprint("coverage loaded for %d of %d changed files" % (len(self.coverage_index), len(src_files)))
+
+    # get ready to look up the coverage of the changed files, from the coverage_loader or the report dir.
+    def load_coverage(self, src_files):
+        if self.report_commit is not None:
+            # the report was built at report_commit: look the files renamed since then up by their old path
+            line_maps = self.get_line_maps(src_files, self.until, self.report_commit)
+            self.report_paths = dict((f, line_maps[f].old_path) for f in src_files)
+            for f in src_files:
+                if self.report_paths[f] != f:
+                    pprint("%s is %s in the report of %s" % (f, self.report_paths[f], self.report_commit))
+        if self.coverage_loader is not None:
+            self.load_coverage_index(src_files)
+        else:
+            self.index_report_dir(src_files)
+            if len(self.report_dirs) > 1:
+                self.load_report_index(src_files)
+
+    # list the report dirs once and find the report page of every changed file in each of them.
+    def index_report_dir(self, src_files):
+        # the pages are named after the files of the tree the report was built from
+        tree_files = [f for f in get_tree_files(self.report_commit or self.until)
+                if os.path.splitext(f)[1][1:] in SOURCE_EXTENSIONS]
+        report_files = [self.report_path(f) for f in src_files if self.report_path(f) is not None]
+        self.report_indexes = []
+        for report_dir in self.report_dirs:
+            report_pages = ReportIndex(report_dir, self.prefix, self.missing_prefix_dir)
+            report_pages.build(report_files, tree_files)
+            for name, files in sorted(report_pages.collisions.items()):
+                pprint("report page %s is shared by %s, found by its header" %
+                        (os.path.join(report_dir, name), ", ".join(files)))
+            self.report_indexes.append(report_pages)
+        self.report_pages = self.report_indexes[0]
+
+    # the path of the report page of @f, or None.
+    def get_report_page(self, f):
+        path = self.report_path(f)
+        if path is None:
+            return None
+        gcov_filename = self.report_pages.lookup(path)
+        if gcov_filename is None:
+            pprint("failed to find html report for %s" % os.path.join(self.report_dir,
+                    convert_filepath_coverage_filename(path, self.missing_prefix_dir, self.prefix, ".html")))
+            return None
+        return os.path.join(self.report_dir, gcov_filename)
+
+    # read the report pages of @src_files in every report dir once, in a process pool with jobs > 1,
+    # so that every range of check_ranges looks its files up in self.coverage_index.
+    def load_report_index(self, src_files):
+        pages = []
+        for f in src_files:
+            path = self.report_path(f)
+            if path is None:
+                continue
+            found = False
+            for report_pages in self.report_indexes:
+                gcov_filename = report_pages.lookup(path)
+                if gcov_filename is not None:
+                    pages.append((f, os.path.join(report_pages.report_dir, gcov_filename)))
+                    found = True
+            if not found:
+                pprint("failed to find html report for %s in %d report dirs" % (f, len(self.report_indexes)))
+        args = [(gcovfile, self.cache) for f, gcovfile in pages]
+        if self.jobs > 1 and len(pages) > 1:
+            pool = Pool(self.jobs, init_worker)
+            try:
+                results = []
+                for result, counts in pool.imap(scan_report_worker, args,
+                        max(1, len(pages) // (self.jobs * 4))):
+                    results.append(result)
+                    PROFILER.add_counts(counts)
+            finally:
+                pool.close()
+                pool.join()
+            if self.cache is not None:
+                self.cache.dirty = True
+        else:
+            results = [scan_report_worker(a)[0] for a in args]
+        self.coverage_index = {}
+        for (f, _), result in zip(pages, results):
+            if f in self.coverage_index:
+                result = merge_line_coverage(self.coverage_index[f], result)
+            self.coverage_index[f] = result
 
     # get the HtmlParser for source file.
-    def get_report_parser(self, f):
-        f = convert_filepath_coverage_filename(f,
-                self.missing_prefix_dir,
-                self.prefix,
-                ".html")
-        gcovfile = os.path.join(self.report_dir, f)
-        if not os.path.exists(gcovfile):
-            pprint("failed to find html report for %s" % gcovfile)
+    # with @lines, also write a copy of its report page with these changed lines marked.
+    def get_report_parser(self, f, lines=None):
+        if self.coverage_index is not None:
+            return self.coverage_index.get(f)
+        gcovfile = self.get_report_page(f)
+        if gcovfile is None:
             return None
-        report_parser = GcovHTMLParser()
-        report_parser.feed(open(gcovfile, 'r').read())
-        return report_parser
+        if lines is not None:
+            link_file = "new_" + os.path.basename(gcovfile)
+            self.detail_pages[f] = link_file
+            # the page is read through to be copied: the cache would save nothing
+            return annotate_report(gcovfile, os.path.join(self.report_dir, link_file), lines)
+        if self.cache is not None:
+            return scan_report_cached(gcovfile, self.cache)
+        return scan_report(gcovfile)
+
+    # the coverage of the changed @lines (a LineSet) of file @f: a tuple of measurable changed lines,
+    # uncovered changed lines and the annotated report page. None if no changed line is measurable.
+    def get_file_recoverage(self, f, lines):
+        report_parser = self.get_report_parser(f, lines if self.details else None)
+        #处理html report
+        if not report_parser:
+            return lines, lines, None
+        link_file = self.detail_pages.pop(f, None)
+        #空行/{}等不计入统计范围
+        lcov_lines = (report_parser.uncovers | report_parser.covers) & lines
+        if len(lcov_lines) == 0:
+            if link_file is not None:
+                os.remove(os.path.join(self.report_dir, link_file))
+            return None
+        uncov_lines = report_parser.uncovers & lines
+        covered_lines = report_parser.covers & lines
+        if DEBUG:
+            print(f, "uncovers:", uncov_lines,  "||covers:", covered_lines, "changed_line_num:", len(lcov_lines))
+        report_parser.close()
+        return lcov_lines, uncov_lines, link_file
 
     def get_recoverage_info(self, changes):
+        if self.coverage_index is None and self.report_pages is None:
+            # called on its own, after get_changed_lines: nothing is loaded yet
+            self.load_coverage(sorted(changes))
+        return self.get_recoverage_stream(sorted(changes.items()), len(changes))
+
+    # @changes: an iterable of (filename, changed lines) for @nfiles files. every file is
+    # handled as soon as it comes, so that a generator of changes overlaps with the reports.
+    def get_recoverage_stream(self, changes, nfiles):
         # self.report_dir
         uncovers = {}
         lcov_changes = {}
         pprint("<<<< get_recoverage_info Begin.")
-        for f, lines in changes.items():
-            report_parser = self.get_report_parser(f)
-            #处理html report
-            if not report_parser:
-                uncovers[f] = lines
-                lcov_changes[f] = lines
-                continue
-            #空行/{}等不计入统计范围
-            lcov_changes[f] = sorted(list(set(report_parser.uncovers + report_parser.covers) & set(lines)))
-            if len(lcov_changes[f]) == 0:
-                del lcov_changes[f]
+        files = []
+        results = []
+        # the html report pages are parsed and annotated in a process pool,
+        # fed from this thread while it reads the changes.
+        if self.jobs > 1 and self.coverage_index is None and nfiles > 1:
+            chunksize = max(1, nfiles // (self.jobs * 4))
+            pool = Pool(self.jobs, init_recoverage_worker, (self,))
+            try:
+                pending = []
+                chunk = []
+                for f, lines in changes:
+                    files.append(f)
+                    chunk.append((f, lines))
+                    if len(chunk) == chunksize:
+                        pending.append(pool.apply_async(recoverage_worker, (chunk,)))
+                        chunk = []
+                if chunk:
+                    pending.append(pool.apply_async(recoverage_worker, (chunk,)))
+                for r in pending:
+                    chunk_results, section = r.get()
+                    results.extend(chunk_results)
+                    # the workers time and count in their own copy of the profiler
+                    PROFILER.add_section(section)
+            finally:
+                pool.close()
+                pool.join()
+            if self.cache is not None:
+                # the workers wrote to their own copy of the cache
+                self.cache.dirty = True
+        else:
+            # the changes are produced by another thread
+            for f, lines in prefetch(changes):
+                files.append(f)
+                with PROFILER.section('recoverage_info'):
+                    results.append(self.get_file_recoverage(f, lines))
+        # merged in the order of the file names, whoever did the work
+        for f, result in sorted(zip(files, results), key=lambda item: item[0]):
+            if result is None:
                 continue
-            uncov_lines = list(set(report_parser.uncovers) & set(lines))
-            uncovers[f] = sorted(uncov_lines)
-            covered_lines = sorted( list(set(report_parser.covers) & set(lines)) )
-            if DEBUG:
-                print(f, "uncovers:", uncovers[f],  "||covers:", covered_lines, "changed_line_num:", len(lcov_changes[f]))
-            report_parser.close()
+            lcov_changes[f], uncovers[f], link_file = result
+            if link_file is not None:
+                self.detail_pages[f] = link_file
         pprint(">>>> get_recoverage_info END.")
         return lcov_changes, uncovers
 
     # @files_coverage_info is a map, key is filename, value is a tuple with two number, changed lines and convered lines
     # changed num, covered num, changed details.
+    # returns the rows of the summary table, rendered by the coverage_tr macro of delta_trs.html.
     def create_coverage_trs(self, files_coverage_info):
         if DEBUG:
             pprint("<<<< create_coverage_trs")
-        tr_tpl = templates().get_template("delta_trs.html")
-        trs = ''
-        for f, v in files_coverage_info.items():
+        trs = []
+        for f, v in sorted(files_coverage_info.items()):
             if v[0] == 0:
                 continue
             changed_line_list = v[2]
             if DEBUG:
                 print("Files:", f, " ||covered/total:", v[1], "/", v[0], " || changed lines:", changed_line_list)
-            gcov_filename = convert_filepath_coverage_filename(f,
-                    self.missing_prefix_dir,
-                    self.prefix,
-                    ".html")
-            gcovrfilepath = os.path.join(self.report_dir, gcov_filename)
-            # mark the changed lines with background color of red from original report
-            if os.path.exists(gcovrfilepath):
-                s = ''
-                source_pattern_str=r'<td align="right" class="lineno"><pre>\d+</pre></td>';
-                p = re.compile(source_pattern_str)
-                for line in open(gcovrfilepath, 'r').readlines():
-                    ps = p.search(line)
-                    if ps:
-                        # modify its back ground
-                        lineno = int(re.findall("\d+", line)[0])
-                        if changed_line_list.count(lineno) == 1:
-                            line = line.replace('class="lineno"', 'class="lineno" style="background:red"')
-                            line = line.replace('<pre>', '<pre>NN  ')
-                        else:
-                            pass
-                    else:
-                        pass
-                    s += line
-                increment_filepath = os.path.join(self.report_dir, "new_"+gcov_filename)
-                open(increment_filepath, 'w').write(s)
-                cover_ratio = round(v[1] * 1.0 / v[0] * 100, 2)
-                bar_color = "yellow"
-                c_color = "yellow"
-                if cover_ratio >= 90.0:
-                    bar_color = "green"
-                    c_color = "LightGreen"
-                if cover_ratio < 75.0:
-                    bar_color = "red"
-                    c_color = "LightPink"
-                trs += tr_tpl.render(source_file=f,
-                        link_file="new_"+gcov_filename,
-                        changed_lines=v[0],
-                        covered_lines=v[1],
-                        bar_color=bar_color,
-                        c_color=c_color,
-                        coverage=cover_ratio)
-            else:
-                print("no such file", gcovrfilepath)
+            # the changed lines are marked in a copy of the report page by get_recoverage_info
+            link_file = self.detail_pages.get(f)
+            if link_file is None and self.details and self.coverage_index is None:
+                print("no such file", f)
+                continue
+            cover_ratio = round(v[1] * 1.0 / v[0] * 100, 2)
+            bar_color = "yellow"
+            c_color = "yellow"
+            if cover_ratio >= 90.0:
+                bar_color = "green"
+                c_color = "LightGreen"
+            if cover_ratio < 75.0:
+                bar_color = "red"
+                c_color = "LightPink"
+            trs.append(dict(source_file=f,
+                    link_file=link_file,
+                    changed_lines=v[0],
+                    covered_lines=v[1],
+                    bar_color=bar_color,
+                    c_color=c_color,
+                    coverage=cover_ratio))
         return trs
 
+    # the compact payload of the paged format, rendered by delta_coverage_paged.html:
+    # dirs is a list of [name, parent index, changed num, covered num], the root first and every
+    # directory after its parent, and files a list of [dir index, base name, changed num, covered num, link].
+    def create_report_data(self, files_coverage_info):
+        keys, totals, covered, links = [], [], [], []
+        for f, v in sorted(files_coverage_info.items()):
+            if v[0] == 0:
+                continue
+            link_file = self.detail_pages.get(f)
+            if link_file is None and self.details and self.coverage_index is None:
+                print("no such file", f)
+                continue
+            keys.append(f)
+            totals.append(v[0])
+            covered.append(v[1])
+            links.append(link_file or 0)
+        table = StatsTable(keys, totals, covered)
+        dir_totals = table.directory_totals()
+        dir_totals[''] = table.total()
+        names = sorted(dir_totals)
+        index = dict((name, i) for i, name in enumerate(names))
+        dirs = []
+        for name in names:
+            parent = os.path.dirname(name)
+            dirs.append([name, index[parent] if name and parent != name else -1] +
+                    list(dir_totals[name]))
+        files = [[index[os.path.dirname(f)], os.path.basename(f), change_num, cov_num, link_file]
+                for (f, change_num, cov_num), link_file in zip(table.rows(), links)]
+        return dict(dirs=dirs, files=files)
+
+    # write the payload of the paged format next to the summary page, and return its name.
+    # a .js file can be loaded by a page opened from the disk, a gzipped one has to be fetched.
+    def write_report_data(self, files_coverage_info):
+        data = json.dumps(self.create_report_data(files_coverage_info), separators=(',', ':'))
+        if self.gzip_data:
+            data_file = self.report_name + '.data.json.gz'
+            f = gzip.open(os.path.join(self.report_dir, data_file), 'wb')
+            data = data.encode('utf-8')
+        else:
+            data_file = self.report_name + '.data.js'
+            f = open(os.path.join(self.report_dir, data_file), 'w')
+            data = 'window.dcovrData = %s;\n' % data
+        with f:
+            f.write(data)
+        PROFILER.count('files')
+        PROFILER.count('bytes_written', os.path.getsize(os.path.join(self.report_dir, data_file)))
+        return data_file
+
+    # the gate: the coverage is over the threshold, or no changed line is measurable
+    # (only headers, comments or other files changed) and there is nothing to cover.
+    def passes(self, change_linenum, coverage):
+        return change_linenum == 0 or coverage > self.thresh
+
     # @uncovers: a map, key is file name, value is a list of uncovered lines.
     # @changes: a map, key is filename, value is a list containing changed lines.
+    # self.passed tells whether the changes pass the threshold.
     def create_report(self, changes, uncovers):
         pprint("<<<< create_report")
-        change_linenum, uncov_linenum = 0, 0
-        for k, v in changes.items():
-            change_linenum += len(v)
-        for k, v in uncovers.items():
-            uncov_linenum += len(v)
-
-        cov_linenum = change_linenum - uncov_linenum
+        # the changed and covered line numbers of every file, counted once
+        table = StatsTable.from_line_sets(changes, uncovers)
+        change_linenum, cov_linenum = table.total()
         coverage = round(cov_linenum * 1.0 / (change_linenum if change_linenum > 0 else 1), 2)
+        self.passed = self.passes(change_linenum, coverage)
 
-        env = templates()
-        increment_report_tpl = env.get_template('delta_coverage_report.html')
+        unknown_linenum = sum(len(lines) for lines in self.unknown_lines.values())
         changed_covered_details = {}
-        for filename in changes.keys():
-            change_num = len(changes[filename])
-            uncov_num = 0
-            if uncovers.has_key(filename):
-                uncov_num = len(uncovers[filename])
-            assert(change_num >= uncov_num)
-            changed_covered_details[filename] = (change_num, change_num - uncov_num, changes[filename])
-        content = increment_report_tpl.render(
+        for filename, change_num, cov_num in table.rows():
+            changed_covered_details[filename] = (change_num, cov_num, changes[filename])
+        if self.output_format != "json":
+            report_path = self.write_html_report(cov_linenum, change_linenum, coverage,
+                    changed_covered_details, unknown_linenum)
+        else:
+            summary = self.json_summary(cov_linenum, change_linenum, coverage,
+                    changed_covered_details, unknown_linenum)
+            if self.summaries is not None:
+                self.summaries.append(summary)
+                report_path = None
+            else:
+                report_path = self.write_json_report(summary)
+        if report_path is not None:
+            PROFILER.count('files')
+            PROFILER.count('bytes_written', os.path.getsize(report_path))
+        pprint("summary of this commit: total line num %d, covered %d, coverage %.2f%%" % (change_linenum, cov_linenum, coverage*100))
+        if change_linenum == 0:
+            pprint("no measurable changed line: nothing to cover")
+        if self.carried_to is not None:
+            pprint("report of commit %s: %d changed lines carried over, %d changed since, not counted" %
+                    (self.carried_to, self.carried_linenum, unknown_linenum))
+        pprint(">>>> create_report")
+        return coverage
+
+    def write_html_report(self, cov_linenum, change_linenum, coverage, changed_covered_details,
+            unknown_linenum=0):
+        env = templates(os.path.join(self.cache.directory, 'jinja2') if self.cache else None)
+        if self.output_format == "paged":
+            # the page does not grow with the number of files: the browser renders the rows
+            increment_report_tpl = env.get_template('delta_coverage_paged.html')
+            rows = dict(data_file=self.write_report_data(changed_covered_details),
+                    data_gzipped=self.gzip_data)
+        else:
+            increment_report_tpl = env.get_template('delta_coverage_report.html')
+            # changed num, covered num, changed details.
+            rows = dict(details_trs=self.create_coverage_trs(changed_covered_details))
+        content = increment_report_tpl.stream(
                 current_time = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(time.time())),
         cov_lines=cov_linenum,
         change_linenum= change_linenum,
         coverage=coverage * 100,
         from_commit=self.since,
         to_commit=self.until,
-        # changed num, covered num, changed details.
-        details_trs=self.create_coverage_trs(changed_covered_details))
-        open(os.path.join(self.report_dir, 'increment_coverage_report.html'), 'w').write(content)
-        pprint("summary of this commit: total line num %d, covered %d, coverage %.2f%%" % (change_linenum, cov_linenum, coverage*100))
-        pprint(">>>> create_report")
-        return coverage
+        report_commit=self.carried_to,
+        unknown_linenum=unknown_linenum,
+        **rows)
+        content.enable_buffering(64)
+        report_path = os.path.join(self.report_dir, self.report_name + '.html')
+        content.dump(report_path)
+        return report_path
+
+    # the machine readable summary: the totals, the gate result and the numbers of every file.
+    # when the changed lines are carried to the report commit, those the report does not know
+    # are counted apart.
+    def json_summary(self, cov_linenum, change_linenum, coverage, changed_covered_details,
+            unknown_linenum=0):
+        files = []
+        for f, v in sorted(changed_covered_details.items()):
+            if v[0] == 0:
+                continue
+            files.append(dict(file=f,
+                    changed_lines=v[0],
+                    covered_lines=v[1],
+                    coverage=round(v[1] * 1.0 / v[0] * 100, 2)))
+        summary = dict(from_commit=self.since,
+                to_commit=self.until,
+                changed_lines=change_linenum,
+                covered_lines=cov_linenum,
+                coverage=round(coverage * 100, 2),
+                threshold=self.thresh * 100,
+                passed=self.passes(change_linenum, coverage),
+                files=files)
+        if self.carried_to is not None:
+            summary.update(report_commit=self.carried_to,
+                    carried_lines=self.carried_linenum,
+                    unknown_lines=unknown_linenum)
+        return summary
+
+    def write_json_report(self, summary):
+        report_path = self.output or os.path.join(self.report_dir, self.report_name + '.json')
+        with open(report_path, 'w') as f:
+            json.dump(summary, f, indent=2, sort_keys=True)
+            f.write('\n')
+        return report_path
 
     def check(self):
         # main function
-        src_files = self.get_changed_files()
-        changes = self.get_changed_lines(src_files)
-        lcov_changes, uncovers = self.get_recoverage_info(changes)
-        return 0 if self.create_report(lcov_changes, uncovers) > self.thresh else 1
+        with PROFILER.stage('get_changed_files'):
+            src_files = self.get_changed_files()
+        with PROFILER.stage('load_coverage_index'):
+            self.load_coverage(src_files)
+        with PROFILER.stage('recoverage_pipeline'):
+            # the reports of the first files are read while git looks for the changed lines of the others.
+            # the git side is timed in the changed_lines section, the reports in recoverage_info.
+            changes = self.iter_changed_lines(src_files)
+            if self.report_commit is not None:
+                changes = self.remap_changed_lines(changes, src_files, self.until, self.report_commit)
+            changes = PROFILER.iter_section('changed_lines', changes)
+            lcov_changes, uncovers = self.get_recoverage_stream(changes, len(src_files))
+        if self.cache is not None:
+            with PROFILER.stage('cache_prune'):
+                self.cache.prune()
+        with PROFILER.stage('create_report'):
+            self.create_report(lcov_changes, uncovers)
+        return 0 if self.passed else 1
+
+    # evaluate several commit ranges in one run: the report pages of the changed files of all
+    # the ranges are read once, and the changed lines come from the cache when they are there.
+    # @ranges: a list of (since, until) pairs.
+    # @each_commit: a (since, until) pair, evaluated as a whole and commit by commit. The lines
+    # of every commit come from its diff with its first parent and are numbered at the commit.
+    # there is a single report, built at report_commit, or at until when it is None; without
+    # either, all the ranges must end at the same commit. the lines of every range and commit
+    # are carried to it from the commit they are numbered at, and the lines changed again since
+    # are unknown to it.
+    # there is one summary per range; html summaries are named after their range, and no
+    # annotated report page is written. returns 0 if every range passes the threshold.
+    def check_ranges(self, ranges, each_commit=None):
+        self.details = False
+        batch = list(ranges)
+        if each_commit is not None:
+            batch.append(each_commit)
+        until = self.until
+        report_commit = self.report_commit or until or batch[0][1]
+        with PROFILER.stage('get_changed_files'):
+            range_files = []
+            for self.since, self.until in batch:
+                range_files.append(self.get_changed_files())
+        with PROFILER.stage('load_coverage_index'):
+            src_files = sorted(set(f for files in range_files for f in files))
+            self.since, self.until = None, until or report_commit
+            self.load_coverage(src_files)
+            if self.coverage_index is None:
+                self.load_report_index(src_files)
+        with PROFILER.stage('get_changed_lines'):
+            # (since, until, changed lines, the commit they are numbered at, the report commit)
+            results = []
+            for (self.since, self.until), files in zip(batch, range_files):
+                results.append((self.since, self.until, self.get_changed_lines(files), self.until,
+                        report_commit))
+            if each_commit is not None:
+                for c in get_range_commit_list(*each_commit):
+                    # only the files of the whole range have lines in its report
+                    self.since, self.until = c + "^", c
+                    changes = dict((f, lines) for f, lines in self.get_changed_lines(range_files[-1]).items()
+                            if lines)
+                    results.append((self.since, self.until, changes, c, report_commit))
+        if self.output_format == "json":
+            self.summaries = []
+        status = 0
+        for self.since, self.until, changes, numbered_at, report_commit in results:
+            self.carried_to = None
+            self.unknown_lines = {}
+            self.carried_linenum = 0
+            if report_commit != numbered_at:
+                with PROFILER.stage('remap_changed_lines'):
+                    changes = dict(self.remap_changed_lines(sorted(changes.items()), sorted(changes),
+                            numbered_at, report_commit))
+            self.report_name = 'increment_coverage_report.' + \
+                    re.sub(r'[^\w.^~-]', '_', '%s..%s' % (self.since, self.until))
+            with PROFILER.stage('get_recoverage_info'):
+                lcov_changes, uncovers = self.get_recoverage_info(changes)
+            with PROFILER.stage('create_report'):
+                self.create_report(lcov_changes, uncovers)
+            if not self.passed:
+                status = 1
+        if self.summaries is not None:
+            self.report_name = 'increment_coverage_report'
+            self.write_json_report(dict(ranges=self.summaries))
+        if self.cache is not None:
+            with PROFILER.stage('cache_prune'):
+                self.cache.prune()
+        return status
+
+
+def scan_report_worker(args):
+    # the coverage of one report page, and the profiler counts of the worker process.
+    gcovfile, cache = args
+    if cache is not None:
+        return scan_report_cached(gcovfile, cache), PROFILER.take_counts()
+    return scan_report(gcovfile), PROFILER.take_counts()
+
+
+# the UTCover of the current worker process of get_recoverage_info
+worker_ut = None
+
+
+def init_recoverage_worker(ut):
+    global worker_ut
+    worker_ut = ut
+    init_worker()
+
+
+def recoverage_worker(chunk):
+    # the results of the chunk, and the recoverage_info section of the worker process.
+    with PROFILER.section('recoverage_info'):
+        results = [worker_ut.get_file_recoverage(f, lines) for f, lines in chunk]
+    return results, PROFILER.take_section('recoverage_info')
 
 
 def run_example():
@@ -296,13 +709,78 @@ def run_example():
 def generate_delta_report(options):
     since_commit = options.since
     until_commit = options.until
-    html_dir = options.source_report_dir
+    report_dirs = []
+    for pattern in options.source_report_dir or ['.']:
+        # a pattern that matches nothing is taken as it is
+        report_dirs.extend(sorted(glob.glob(pattern)) or [pattern])
+    html_dir = report_dirs[0]
     prefix = options.prefix
     missing_prefix_dir = options.missing_prefix_dir
-    UTCover(since_commit=since_commit,
+    cache = None
+    if options.cache:
+        cache = DiskCache(options.cache_dir, options.cache_size * 1024 * 1024)
+    coverage_loader = None
+    if options.gcovr_json:
+        coverage_loader = partial(read_gcovr_json, options.gcovr_json)
+    elif options.lcov:
+        coverage_loader = partial(read_lcov_tracefiles, options.lcov)
+    logger = Logger(options.verbose)
+    filters = FilterSet(build_filter(logger, f) for f in options.filter)
+    excludes = FilterSet(build_filter(logger, f) for f in options.exclude)
+    aliaser = None
+    if options.path_aliases:
+        aliaser = PathAliaser()
+        for alias, target in options.path_aliases:
+            aliaser.add_alias(os.path.normpath(alias), os.path.normpath(target))
+    if options.gcov_build_dir:
+        coverage_loader = partial(read_gcov_coverage, options.gcov_build_dir,
+                gcov_cmd=options.gcov_cmd, jobs=options.jobs,
+                exclude_dirs=[build_filter(logger, f) for f in options.exclude_dirs])
+    PROFILER.enabled = options.profile is not None
+    profile = None
+    if options.cprofile is not None:
+        profile = cProfile.Profile()
+        profile.enable()
+    ut = UTCover(since_commit=since_commit,
             until_commit=until_commit,
             report_dir=html_dir,
             prefix=prefix,
             missing_prefix_dir=missing_prefix_dir,
-            thresh=0.2).check()
+            thresh=0.2,
+            engine=options.changed_lines,
+            jobs=options.jobs,
+            coverage_loader=coverage_loader,
+            cache=cache,
+            details=options.output_format != "json" and not options.summary_only,
+            output_format=options.output_format,
+            output=options.output,
+            shard_dirs=report_dirs[1:],
+            filters=filters,
+            excludes=excludes,
+            aliaser=aliaser,
+            report_commit=options.report_commit,
+            gzip_data=options.gzip_data)
+    try:
+        if options.ranges or options.each_commit:
+            ranges = list(options.ranges)
+            each_commit = None
+            if options.each_commit:
+                each_commit = (since_commit, until_commit)
+            elif since_commit is not None:
+                # --since..--until is a range like the others
+                ranges.insert(0, (since_commit, until_commit))
+            status = ut.check_ranges(ranges, each_commit)
+        else:
+            status = ut.check()
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(options.cprofile)
+            logger.verbose_msg("cProfile data written to {}", options.cprofile)
+    if options.profile is not None:
+        PROFILER.dump(options.profile)
+        PROFILER.log_summary(logger)
+    # the gate-only runs fail when a range misses the threshold, the html report is always a success
+    if options.summary_only or options.output_format == "json":
+        sys.exit(status)
     sys.exit(0)
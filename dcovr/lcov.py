@@ -0,0 +1,59 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Read the line coverage out of lcov ``.info`` tracefiles.
+
+The tracefiles are streamed line by line. Per-line data is only kept for
+the records of changed files, the other records are skipped up to their
+``end_of_record`` line.
+"""
+
+import os
+import sys
+
+from .coverage import build_line_coverage, open_maybe_gzipped
+from .profiling import PROFILER
+
+
+def decode_path(path):
+    # the tracefile is read as bytes, but paths are str on Python 3
+    if not isinstance(path, str):
+        path = path.decode(sys.getfilesystemencoding() or 'utf-8')
+    return path
+
+
+def read_lcov_tracefiles(paths, resolver):
+    """
+    Build a dict mapping every changed file found in the lcov tracefiles
+    ``paths`` to its LineCoverage.
+
+    The counts of records for the same file are added up.
+    """
+    counts = {}
+    for path in paths:
+        PROFILER.count('files')
+        PROFILER.count('bytes_read', os.path.getsize(path))
+        file_counts = None
+        with open_maybe_gzipped(path) as f:
+            for line in f:
+                if line.startswith(b'SF:'):
+                    src = resolver.resolve(decode_path(line[3:].strip()))
+                    file_counts = (None if src is None
+                                   else counts.setdefault(src, {}))
+                elif file_counts is None:
+                    continue
+                elif line.startswith(b'DA:'):
+                    # DA:<line number>,<execution count>[,<checksum>]
+                    fields = line[3:].split(b',')
+                    try:
+                        lineno, count = int(fields[0]), int(fields[1])
+                    except (IndexError, ValueError):
+                        continue
+                    file_counts[lineno] = file_counts.get(lineno, 0) + count
+                elif line.startswith(b'end_of_record'):
+                    file_counts = None
+    return dict((f, build_line_coverage(c)) for f, c in counts.items())
@@ -0,0 +1,164 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+A compact set of line numbers.
+
+Changed and covered lines come in runs of contiguous lines, so a LineSet
+keeps sorted, disjoint ``[start, end)`` intervals in two arrays. Memory,
+intersection and counting scale with the number of runs, not the number
+of lines.
+"""
+
+from array import array
+from bisect import bisect_right
+
+
+class LineSet(object):
+    """
+    lines: the line numbers to start with, in any order
+    """
+
+    def __init__(self, lines=()):
+        if isinstance(lines, LineSet):
+            self.starts = array('l', lines.starts)
+            self.ends = array('l', lines.ends)
+            self.size = lines.size
+            return
+        self.starts = array('l')
+        self.ends = array('l')
+        self.size = 0
+        for lineno in sorted(set(lines)):
+            self.add(lineno)
+
+    @classmethod
+    def from_ranges(cls, ranges):
+        """Build a LineSet from ``(start, count)`` pairs, in any order."""
+        lines = cls()
+        for start, count in sorted(ranges):
+            lines.add_range(start, count)
+        return lines
+
+    def to_ranges(self):
+        """Return the ``[start, count]`` pairs of the lines, for from_ranges()."""
+        return [[start, end - start] for start, end in self.ranges()]
+
+    def add_range(self, start, count):
+        """Add ``count`` lines from ``start``."""
+        if count <= 0:
+            return
+        end = start + count
+        if self.ends and start < self.ends[-1]:
+            # out of order: merge with the existing intervals
+            merged = self | LineSet.from_ranges([(start, count)])
+            self.starts, self.ends, self.size = \
+                merged.starts, merged.ends, merged.size
+        elif self.ends and start == self.ends[-1]:
+            self.ends[-1] = end
+            self.size += count
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.size += count
+
+    def add(self, lineno):
+        """Add a line. Adding the lines in ascending order is the fast path."""
+        if not self.ends or lineno >= self.ends[-1]:
+            self.add_range(lineno, 1)
+        elif lineno not in self:
+            self.add_range(lineno, 1)
+
+    def ranges(self):
+        """Yield the ``(start, end)`` intervals, ``end`` excluded."""
+        return zip(self.starts, self.ends)
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            for lineno in range(start, end):
+                yield lineno
+
+    def __contains__(self, lineno):
+        i = bisect_right(self.starts, lineno) - 1
+        return i >= 0 and lineno < self.ends[i]
+
+    def __eq__(self, other):
+        if not isinstance(other, LineSet):
+            return NotImplemented
+        return self.starts == other.starts and self.ends == other.ends
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __repr__(self):
+        return 'LineSet(%s)' % ', '.join(
+            '%d' % s if e == s + 1 else '%d-%d' % (s, e - 1)
+            for s, e in self.ranges())
+
+    def _append(self, start, end):
+        # append [start, end) after the last interval, coalescing them
+        if self.ends and start <= self.ends[-1]:
+            if end > self.ends[-1]:
+                self.size += end - self.ends[-1]
+                self.ends[-1] = end
+        else:
+            self.starts.append(start)
+            self.ends.append(end)
+            self.size += end - start
+
+    def __and__(self, other):
+        if not isinstance(other, LineSet):
+            other = LineSet(other)
+        result = LineSet()
+        i, j = 0, 0
+        a_starts, a_ends = self.starts, self.ends
+        b_starts, b_ends = other.starts, other.ends
+        while i < len(a_starts) and j < len(b_starts):
+            start = max(a_starts[i], b_starts[j])
+            end = min(a_ends[i], b_ends[j])
+            if start < end:
+                result._append(start, end)
+            if a_ends[i] < b_ends[j]:
+                i += 1
+            else:
+                j += 1
+        return result
+
+    def __or__(self, other):
+        if not isinstance(other, LineSet):
+            other = LineSet(other)
+        result = LineSet()
+        intervals = sorted(list(self.ranges()) + list(other.ranges()))
+        for start, end in intervals:
+            result._append(start, end)
+        return result
+
+    def __sub__(self, other):
+        if not isinstance(other, LineSet):
+            other = LineSet(other)
+        result = LineSet()
+        j = 0
+        b_starts, b_ends = other.starts, other.ends
+        for start, end in self.ranges():
+            while j < len(b_starts) and b_ends[j] <= start:
+                j += 1
+            k = j
+            while start < end and k < len(b_starts) and b_starts[k] < end:
+                if b_starts[k] > start:
+                    result._append(start, b_starts[k])
+                start = max(start, b_ends[k])
+                k += 1
+            if start < end:
+                result._append(start, end)
+        return result
@@ -0,0 +1,208 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Per-stage timing and counters of a dcovr run.
+
+The pipeline stages run inside ``PROFILER.stage(name)``, and the code that
+starts subprocesses, reads or writes reports calls ``PROFILER.count()``.
+Both cost next to nothing while the profiler is disabled.
+
+Work that runs in many short calls overlapping with other work, like the
+two sides of the changed lines / report pages pipeline, runs inside
+``PROFILER.section(name)``: the time of every call is added up in one
+record, so the profile still tells which side the time went to.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+def cpu_time():
+    # user + system time of this process and of its waited-for children
+    t = os.times()
+    return t[0] + t[1] + t[2] + t[3]
+
+
+def thread_cpu_time():
+    # the time of the calling thread where Python tells it (3.7+), else of the whole process,
+    # plus the time of the waited-for children
+    if hasattr(time, 'thread_time'):
+        t = os.times()
+        return time.thread_time() + t[2] + t[3]
+    return cpu_time()
+
+
+class Profiler(object):
+    """
+    Wall and CPU time plus counters (subprocesses, bytes_read,
+    bytes_written, files) of every stage of a run, in execution order.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.stages = []
+        self.current = None
+        self.lock = threading.Lock()
+        # the section records by name, and the section of every thread
+        self.sections = {}
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        record = {'stage': name, 'counters': {}}
+        outer, self.current = self.current, record
+        wall, cpu = time.time(), cpu_time()
+        try:
+            yield
+        finally:
+            record['wall_seconds'] = round(time.time() - wall, 6)
+            record['cpu_seconds'] = round(cpu_time() - cpu, 6)
+            self.stages.append(record)
+            self.current = outer
+
+    @contextmanager
+    def section(self, name):
+        """
+        Add the wall and CPU time of this call to the record of section
+        ``name``, and the counters of the calling thread meanwhile. The
+        record is created on the first call.
+        """
+        if not self.enabled:
+            yield
+            return
+        record = self.section_record(name)
+        outer, self.local.record = getattr(self.local, 'record', None), record
+        wall, cpu = time.time(), thread_cpu_time()
+        try:
+            yield
+        finally:
+            self.add_time(record, time.time() - wall, thread_cpu_time() - cpu)
+            self.local.record = outer
+
+    def iter_section(self, name, iterable):
+        """Yield the items of ``iterable``, computing each of them in section ``name``."""
+        iterator = iter(iterable)
+        while True:
+            with self.section(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def section_record(self, name):
+        with self.lock:
+            record = self.sections.get(name)
+            if record is None:
+                record = {'stage': name, 'counters': {}, 'calls': 0,
+                          'wall_seconds': 0.0, 'cpu_seconds': 0.0}
+                self.sections[name] = record
+                self.stages.append(record)
+            return record
+
+    def add_time(self, record, wall, cpu, calls=1):
+        with self.lock:
+            record['calls'] += calls
+            record['wall_seconds'] = round(record['wall_seconds'] + wall, 6)
+            record['cpu_seconds'] = round(record['cpu_seconds'] + cpu, 6)
+
+    def take_section(self, name):
+        """
+        Return and reset the record of section ``name``. Worker processes
+        use it to send their time and counts back to the parent.
+        """
+        if not self.enabled or name not in self.sections:
+            return None
+        with self.lock:
+            record = self.sections.pop(name)
+            self.stages.remove(record)
+        return record
+
+    def add_section(self, record):
+        """Add a record of take_section() to the section of the same name."""
+        if record is None:
+            return
+        section = self.section_record(record['stage'])
+        self.add_time(section, record['wall_seconds'], record['cpu_seconds'],
+                      record['calls'])
+        for counter, n in record['counters'].items():
+            self.count_in(section, counter, n)
+
+    def thread_initializer(self):
+        """
+        Return a function that puts the thread calling it in the section
+        of the current thread, for the threads of a ThreadPool.
+        """
+        record = getattr(self.local, 'record', None)
+
+        def initializer():
+            self.local.record = record
+        return initializer
+
+    def reset(self):
+        """Forget the records copied from the parent into a worker process."""
+        self.stages = []
+        self.sections = {}
+        self.local = threading.local()
+        if self.current is not None:
+            self.current = {'stage': self.current['stage'], 'counters': {}}
+
+    def count(self, counter, n=1):
+        if not self.enabled:
+            return
+        record = getattr(self.local, 'record', None) or self.current
+        if record is not None:
+            self.count_in(record, counter, n)
+
+    def count_in(self, record, counter, n):
+        with self.lock:
+            counters = record['counters']
+            counters[counter] = counters.get(counter, 0) + n
+
+    def take_counts(self):
+        """
+        Return and reset the counters of the current stage. Worker
+        processes use it to send their counts back to the parent.
+        """
+        if not self.enabled or self.current is None:
+            return {}
+        with self.lock:
+            counters, self.current['counters'] = self.current['counters'], {}
+        return counters
+
+    def add_counts(self, counters):
+        for counter, n in counters.items():
+            self.count(counter, n)
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            json.dump({'stages': self.stages}, f, indent=2, sort_keys=True)
+
+    def log_summary(self, logger):
+        for record in self.stages:
+            counters = sorted(record['counters'].items())
+            if 'calls' in record:
+                counters.insert(0, ('calls', record['calls']))
+            counters = ', '.join('%s=%d' % item for item in counters)
+            logger.verbose_msg(
+                "profile: {stage:<22} wall {wall:9.3f}s  cpu {cpu:9.3f}s  {counters}",
+                stage=record['stage'], wall=record['wall_seconds'],
+                cpu=record['cpu_seconds'], counters=counters)
+
+
+PROFILER = Profiler()
+
+
+def init_worker():
+    # the initializer of the worker processes of a Pool
+    PROFILER.reset()
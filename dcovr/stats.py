@@ -0,0 +1,81 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+The total and covered counts of every file of a run, in columns.
+
+The counts are gathered once into a StatsTable. The global totals and the
+directory rollups are then computed on its columns.
+"""
+
+import posixpath
+
+
+class StatsTable(object):
+    """
+    keys: the names of the rows, usually file names
+    totals: the total count of every row, in the order of keys
+    covered: the covered count of every row, in the order of keys
+    """
+
+    def __init__(self, keys, totals, covered):
+        self.keys = list(keys)
+        self.totals = list(totals)
+        self.covered = list(covered)
+
+    @classmethod
+    def from_line_sets(cls, changes, uncovers):
+        """
+        The changed lines of every file of ``changes`` that are not in
+        ``uncovers`` are covered. Both map file names to sets of lines.
+        """
+        keys = sorted(changes)
+        totals = [len(changes[key]) for key in keys]
+        uncovered = [len(uncovers.get(key, ())) for key in keys]
+        assert all(t >= u for t, u in zip(totals, uncovered))
+        return cls(keys, totals, [t - u for t, u in zip(totals, uncovered)])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def rows(self):
+        """Return the ``(key, total, covered)`` rows."""
+        return zip(self.keys, self.totals, self.covered)
+
+    def total(self):
+        """Return the ``(total, covered)`` counts of the whole table."""
+        return sum(self.totals), sum(self.covered)
+
+    def directory_totals(self):
+        """
+        Return a dict mapping every directory of the keys to its
+        ``(total, covered)`` counts, including the files of its
+        subdirectories.
+        """
+        # sum the rows of every directory holding files first, then add
+        # these sums to every ancestor: there are few directories
+        directories = {}
+        dir_index = [directories.setdefault(posixpath.dirname(key),
+                                            len(directories))
+                     for key in self.keys]
+        totals = [0] * len(directories)
+        covered = [0] * len(directories)
+        for d, total, cov in zip(dir_index, self.totals, self.covered):
+            totals[d] += total
+            covered[d] += cov
+        rollups = {}
+        for directory, d in directories.items():
+            while directory:
+                rollup = rollups.setdefault(directory, [0, 0])
+                rollup[0] += totals[d]
+                rollup[1] += covered[d]
+                parent = posixpath.dirname(directory)
+                if parent == directory:
+                    break
+                directory = parent
+        return dict((directory, tuple(rollup))
+                    for directory, rollup in rollups.items())
+
@@ -9,6 +9,23 @@
 import os
 import re
 import sys
+import threading
+from multiprocessing.pool import ThreadPool
+
+# os.scandir is new in Python 3.5; Python 2 may have the scandir backport
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+# Queue was renamed in Python 3
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
 
 # iZip is only available in 2.x
 try:
@@ -17,6 +34,22 @@ except ImportError:
     pass
 
 
+# realpath() of the paths seen so far
+_realpaths = {}
+
+
+def cached_realpath(path):
+    """
+    Return os.path.realpath(path), remembering it: the file system is not
+    expected to change during a run.
+    """
+    try:
+        return _realpaths[path]
+    except KeyError:
+        real = _realpaths[path] = os.path.realpath(path)
+        return real
+
+
 def resolve_symlinks(orig_path):
     """
     Return the normalized absolute path name with all symbolic links resolved
@@ -45,53 +78,122 @@ def resolve_symlinks(orig_path):
 #
 # Class that creates path aliases
 #
+class PathTrie(object):
+    """
+    Map path prefixes to values, comparing whole path components, so
+    that '/a/b' is a prefix of '/a/b/c' but not of '/a/bc'.
+    """
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def split(self, path):
+        if len(path) > 1:
+            path = path.rstrip(os.path.sep)
+        return path.split(os.path.sep)
+
+    def insert(self, base, value):
+        node = self.root
+        for part in self.split(base):
+            node = node.setdefault(part, {})
+        if None not in node:
+            self.size += 1
+        # None is never a path component
+        node[None] = (base.rstrip(os.path.sep) or base, value)
+
+    def longest_prefix(self, path):
+        """Return the (base, value) of the longest prefix of path, or None."""
+        found = None
+        node = self.root
+        for part in path.split(os.path.sep):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                found = node[None]
+        return found
+
+    def __len__(self):
+        return self.size
+
+
 class PathAliaser(object):
+    """
+    Rewrite paths through aliases of their prefixes.
+
+    The aliases and the master targets are kept in PathTries, so a path
+    costs one walk over its components whatever the number of aliases,
+    and the result of every path is remembered.
+    """
 
     def __init__(self):
-        self.aliases = {}
-        self.master_targets = set()
+        self.aliases = PathTrie()
+        self.master_targets = PathTrie()
         self.preferred_name = {}
+        self.master_paths = {}
+        self.unaliased_paths = {}
 
     def path_startswith(self, path, base):
         return path.startswith(base) and (
             len(base) == len(path) or path[len(base)] == os.path.sep)
 
     def master_path(self, path):
+        try:
+            return self.master_paths[path]
+        except KeyError:
+            pass
+        result = None
         match_found = False
-        while True:
-            for base, alias in self.aliases.items():
-                if self.path_startswith(path, base):
-                    path = alias + path[len(base):]
-                    match_found = True
-                    break
-            for master_base in self.master_targets:
-                if self.path_startswith(path, master_base):
-                    return path, master_base, True
-            if match_found:
+        alias = self.aliases.longest_prefix(path)
+        if alias is not None:
+            base, master = alias
+            path_in_master = master + path[len(base):]
+            match_found = True
+        else:
+            path_in_master = path
+        target = self.master_targets.longest_prefix(path_in_master)
+        if target is not None:
+            result = (path_in_master, target[0], True)
+        else:
+            # aliases without master targets only rename paths
+            if match_found and len(self.master_targets):
                 sys.stderr.write(
                     "(ERROR) violating fundamental assumption while walking "
                     "directory tree.\n\tPlease report this to the gcovr "
                     "developers.\n")
-            return path, None, match_found
+            result = (path_in_master, None, match_found)
+        self.master_paths[path] = result
+        return result
 
     def unalias_path(self, path):
-        path = resolve_symlinks(path)
-        path, master_base, known_path = self.master_path(path)
-        if not known_path:
-            return path
+        try:
+            return self.unaliased_paths[path]
+        except KeyError:
+            pass
+        real = cached_realpath(path)
+        master, master_base, known_path = self.master_path(real)
         # Try and resolve the preferred name for this location
-        if master_base in self.preferred_name:
-            return self.preferred_name[master_base] + path[len(master_base):]
-        return path
+        if known_path and master_base in self.preferred_name:
+            master = self.preferred_name[master_base] + master[len(master_base):]
+        self.unaliased_paths[path] = master
+        return master
+
+    def forget(self):
+        self.master_paths.clear()
+        self.unaliased_paths.clear()
 
     def add_master_target(self, master):
-        self.master_targets.add(master)
+        self.master_targets.insert(master, True)
+        self.forget()
 
     def add_alias(self, target, master):
-        self.aliases[target] = master
+        self.aliases.insert(target, master)
+        self.forget()
 
     def set_preferred(self, master, preferred):
         self.preferred_name[master] = preferred
+        self.forget()
 
 
 aliases = PathAliaser()
@@ -133,17 +235,95 @@ aliases = PathAliaser()
 # I have replaced this logic with os.walk(), which works for Python >= 2.6
 #
 def link_walker(path, exclude_dirs):
+    excludes = FilterSet(exclude_dirs)
     for root, dirs, files in os.walk(os.path.abspath(path), followlinks=True):
-        dirs[:] = [d for d in dirs
-                   if not any(exc.match(os.path.join(root, d))
-                              for exc in exclude_dirs)]
-        yield (os.path.abspath(os.path.realpath(root)), dirs, files)
+        if excludes:
+            dirs[:] = [d for d in dirs
+                       if not excludes.match(os.path.join(root, d))]
+        yield (os.path.abspath(cached_realpath(root)), dirs, files)
+
+
+def scan_directory(real_dir, path, excludes, seen, lock):
+    """
+    List one directory for walk_files(): return its files as
+    (real directory, name, is a link) and its subdirectories as
+    (real path, walked path), leaving out the excluded ones and the
+    ones already seen through another link.
+    """
+    files = []
+    subdirs = []
+    try:
+        entries = list(scandir(path))
+    except OSError:
+        return files, subdirs
+    for entry in entries:
+        try:
+            # DirEntry answers from the directory listing, or stats once
+            if not entry.is_dir():
+                files.append((real_dir, entry.name, entry.is_symlink()))
+                continue
+            if excludes and excludes.match(entry.path):
+                continue
+            st = entry.stat()
+        except OSError:
+            continue
+        with lock:
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+        if entry.is_symlink():
+            real = cached_realpath(entry.path)
+        else:
+            real = os.path.join(real_dir, entry.name)
+        subdirs.append((real, entry.path))
+    return files, subdirs
+
 
+def walk_files(path, exclude_dirs, jobs=1):
+    """
+    Walk the tree under ``path`` like link_walker(), with os.scandir and
+    up to ``jobs`` directories listed at the same time, and return the
+    (real directory, name, is a link) of every file.
 
-def search_file(expr, path, exclude_dirs):
+    The excluded directories are pruned before they are listed, and a
+    directory reached again through a link is skipped by its
+    (st_dev, st_ino), so that link loops end.
+    """
+    excludes = FilterSet(exclude_dirs)
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    seen = set([(st.st_dev, st.st_ino)])
+    lock = threading.Lock()
+
+    def scan(directory):
+        return scan_directory(directory[0], directory[1], excludes, seen, lock)
+
+    files = []
+    level = [(cached_realpath(path), path)]
+    pool = ThreadPool(jobs) if jobs > 1 else None
+    try:
+        # one level of the tree at a time
+        while level:
+            if pool is not None and len(level) > 1:
+                results = pool.map(scan, level)
+            else:
+                results = [scan(directory) for directory in level]
+            level = []
+            for dir_files, subdirs in results:
+                files.extend(dir_files)
+                level.extend(subdirs)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return files
+
+
+def search_file(expr, path, exclude_dirs, jobs=1):
     """
     Given a search path, recursively descend to find files that match a
-    regular expression.
+    regular expression. With os.scandir, up to ``jobs`` directories are
+    listed at the same time.
     """
     ans = []
     pattern = re.compile(expr)
@@ -151,6 +331,17 @@ def search_file(expr, path, exclude_dirs):
         path = os.getcwd()
     elif not os.path.exists(path):
         raise IOError("Unknown directory '" + path + "'")
+    if scandir is not None:
+        for root, name, is_link in walk_files(path, exclude_dirs, jobs):
+            if pattern.match(name):
+                name = os.path.join(root, name)
+                if is_link:
+                    # a relative link is relative to its own directory
+                    ans.append(os.path.abspath(
+                        os.path.join(root, os.readlink(name))))
+                else:
+                    ans.append(name)
+        return ans
     for root, _, files in link_walker(path, exclude_dirs):
         for name in files:
             if pattern.match(name):
@@ -249,7 +440,7 @@ class Filter(object):
 
 class AbsoluteFilter(Filter):
     def match(self, path):
-        abspath = os.path.realpath(path)
+        abspath = cached_realpath(path)
         return super(AbsoluteFilter, self).match(abspath)
 
 
@@ -259,7 +450,7 @@ class RelativeFilter(Filter):
         self.root = root
 
     def match(self, path):
-        abspath = os.path.realpath(path)
+        abspath = cached_realpath(path)
         relpath = os.path.relpath(abspath, self.root)
         return super(RelativeFilter, self).match(relpath)
 
@@ -283,6 +474,84 @@ class DirectoryPrefixFilter(Filter):
         super(DirectoryPrefixFilter, self).__init__(pattern)
 
 
+# backreferences are numbered or named across the whole pattern, and global
+# flags must come first: a filter using them cannot be part of an alternation.
+UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?[aiLmsux]+\)')
+
+
+class FilterSet(object):
+    """
+    Match paths against many filters in one pass.
+
+    The filters are grouped by the path they look at: the path as given,
+    its real path, or its real path relative to a root. The patterns of a
+    group are compiled into a single alternation, so that a path costs
+    one realpath() and one regex match per group. Both the real paths and
+    the results are remembered.
+
+    filters: the filters, of which any may match
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.always = any(isinstance(f, AlwaysMatchFilter)
+                          for f in self.filters)
+        patterns = {}
+        # filters of other types are asked one by one
+        self.others = []
+        for f in self.filters:
+            if type(f) in (Filter, DirectoryPrefixFilter):
+                key = ('path', None)
+            elif type(f) is AbsoluteFilter:
+                key = ('abs', None)
+            elif type(f) is RelativeFilter:
+                key = ('rel', f.root)
+            else:
+                if not isinstance(f, AlwaysMatchFilter):
+                    self.others.append(f)
+                continue
+            patterns.setdefault(key, []).append(f.pattern.pattern)
+        self.groups = []
+        for (kind, root), group in sorted(patterns.items()):
+            combined = [p for p in group if not UNCOMBINABLE.search(p)]
+            regexes = [re.compile(p) for p in group
+                       if UNCOMBINABLE.search(p)]
+            if combined:
+                regexes.append(re.compile(
+                    '|'.join('(?:%s)' % p for p in combined)))
+            self.groups.append((kind, root, regexes))
+        self.results = {}
+
+    def __len__(self):
+        return len(self.filters)
+
+    def match(self, path):
+        try:
+            return self.results[path]
+        except KeyError:
+            result = self.results[path] = self._match(path)
+            return result
+
+    def _match(self, path):
+        if self.always:
+            return True
+        for kind, root, regexes in self.groups:
+            if kind == 'path':
+                target = path
+            elif kind == 'abs':
+                target = cached_realpath(path)
+            else:
+                target = os.path.relpath(cached_realpath(path), root)
+            target = target.replace(os.path.sep, '/')
+            for regex in regexes:
+                if regex.match(target):
+                    return True
+        return any(f.match(path) for f in self.others)
+
+    def __str__(self):
+        return "FilterSet({})".format(', '.join(str(f) for f in self.filters))
+
+
 class Logger(object):
     def __init__(self, verbose=False):
         self.verbose = verbose
@@ -356,3 +625,34 @@ def sort_coverage(covdata, show_branch,
         key_fn = None  # default key, sort alphabetically
 
     return sorted(covdata, key=key_fn)
+
+
+def prefetch(iterable, maxsize=0):
+    """
+    Iterate over ``iterable`` in a background thread and yield its items
+    as they come, so that producing them overlaps with consuming them.
+    An exception of the iterable is raised again in the consumer.
+    """
+    queue = Queue(maxsize)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put((item, None))
+        except BaseException as e:
+            queue.put((done, e))
+            return
+        queue.put((done, None))
+
+    producer = threading.Thread(target=produce)
+    producer.daemon = True
+    producer.start()
+    while True:
+        item, error = queue.get()
+        if item is done:
+            break
+        yield item
+    producer.join()
+    if error is not None:
+        raise error
@@ -10,5 +10,7 @@ setup(name='dcovr',
       packages=['dcovr'],
       package_dir={'dcovr': 'dcovr'},
       package_data={'dcovr': ['templates/*.html']},
+      # streams the --gcovr-json reports instead of loading them at once
+      extras_require={'json': ['ijson']},
       scripts=['dcovr/scripts/dcov'],
       zip_safe=False)
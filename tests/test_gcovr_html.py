@@ -0,0 +1,159 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Check the regex scanner of the gcovr detail pages against GcovHTMLParser,
+and the single pass annotation against the line by line one.
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from dcovr.gcovr_html import (GcovHTMLParser, annotate_lines, annotate_report,
+                              parse_report, scan_report)
+from dcovr.lineset import LineSet
+
+PAGE = '''<html>
+<head><title>GCC Code Coverage Report</title></head>
+<body>
+<table width="100%%" border=0 cellspacing=0 cellpadding=0>
+  <tr><td class="headerName">File:</td>
+  <td class="headerValue">src/a/foo.cpp</td></tr>
+</table>
+<table cellspacing="0" cellpadding="1">
+  <tr>
+    <td width="5%%" align="right" class="srcHeader">Line</td>
+    <td width="5%%" align="right" class="srcHeader">Branch</td>
+    <td width="5%%" align="right" class="srcHeader">Exec</td>
+    <td width="75%%" align="left" class="srcHeader src">Source</td>
+  </tr>
+%s</table>
+</body>
+</html>
+'''
+
+ROW = '''
+    <tr>
+    <td align="right" class="lineno"><pre>%(lineno)d</pre></td>
+    <td align="right" class="linebranch">%(branch)s</td>
+    <td align="right" class="linecount %(state)s"><pre>%(count)s</pre></td>
+    <td align="left" class="src %(state)s"><pre>%(src)s</pre></td>
+    </tr>
+'''
+
+# the cells in another order: the regex does not recognize the row
+OTHER_ROW = '''
+    <tr>
+    <td class="lineno" align="right"><pre>%(lineno)d</pre></td>
+    <td class="linebranch" align="right">%(branch)s</td>
+    <td class="linecount %(state)s" align="right"><pre>%(count)s</pre></td>
+    <td class="src %(state)s" align="left"><pre>%(src)s</pre></td>
+    </tr>
+'''
+
+BRANCHES = (
+    '\n      <span class="takenBranch" title="Branch 0 taken 3 times">&check;</span>'
+    '<br/>\n      <span class="notTakenBranch" title="Branch 1 not taken">&cross;</span>\n    ')
+
+# (state, count, branch) of lines 1 to 12: covered, uncovered, not measurable
+LINES = [
+    ('', '', ''),
+    ('coveredLine', '1', ''),
+    ('coveredLine', '40', BRANCHES),
+    ('uncoveredLine', '', ''),
+    ('uncoveredLine', '', BRANCHES),
+    ('', '', ''),
+    ('coveredLine', '2', ''),
+    ('coveredLine', '2', ''),
+    ('', '', ''),
+    ('uncoveredLine', '', ''),
+    ('coveredLine', '7', BRANCHES),
+    ('', '', ''),
+]
+
+
+def make_page(row=ROW):
+    rows = []
+    for lineno, (state, count, branch) in enumerate(LINES, 1):
+        rows.append(row % dict(lineno=lineno, branch=branch, state=state,
+                               count=count, src='int x%d = 0;' % lineno))
+    return PAGE % ''.join(rows)
+
+
+class ReportPageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='dcovr-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def assertSameCoverage(self, report, expected):
+        self.assertEqual(report.covers, expected.covers)
+        self.assertEqual(report.uncovers, expected.uncovers)
+
+    def test_scan_report(self):
+        path = self.write('utcov.a_foo.cpp.html', make_page())
+        expected = parse_report(path)
+        self.assertEqual(expected.covers, LineSet([2, 3, 7, 8, 11]))
+        self.assertEqual(expected.uncovers, LineSet([4, 5, 10]))
+        report = scan_report(path)
+        self.assertNotIsInstance(report, GcovHTMLParser)
+        self.assertSameCoverage(report, expected)
+
+    def test_scan_report_fallback(self):
+        path = self.write('utcov.a_foo.cpp.html', make_page(OTHER_ROW))
+        expected = parse_report(path)
+        self.assertEqual(expected.covers, LineSet([2, 3, 7, 8, 11]))
+        report = scan_report(path)
+        # the fallback is the parser itself
+        self.assertIsInstance(report, GcovHTMLParser)
+        self.assertSameCoverage(report, expected)
+
+    def test_scan_empty_page(self):
+        path = self.write('utcov.empty.cpp.html', '')
+        self.assertSameCoverage(scan_report(path), parse_report(path))
+
+    def check_annotation(self, page, changed_lines):
+        path = self.write('utcov.a_foo.cpp.html', page)
+        expected = parse_report(path)
+        measurable = (expected.covers | expected.uncovers) & changed_lines
+        expected_path = os.path.join(self.tmpdir, 'expected.html')
+        annotate_lines(path, expected_path, measurable)
+        output_path = os.path.join(self.tmpdir, 'new_utcov.a_foo.cpp.html')
+        report = annotate_report(path, output_path, changed_lines)
+        self.assertSameCoverage(report, expected)
+        self.assertEqual(self.read(output_path), self.read(expected_path))
+        return self.read(output_path)
+
+    def test_annotate_report(self):
+        # a covered, an uncovered with branches and a not measurable line
+        output = self.check_annotation(make_page(), LineSet([1, 3, 5, 6, 20]))
+        self.assertEqual(output.count(b'style="background:red"'), 2)
+
+    def test_annotate_report_nothing_changed(self):
+        page = make_page()
+        output = self.check_annotation(page, LineSet())
+        self.assertEqual(output, page.encode('ascii'))
+
+    def test_annotate_report_fallback(self):
+        self.check_annotation(make_page(OTHER_ROW), LineSet([2, 4, 6]))
+
+
+if __name__ == '__main__':
+    unittest.main()
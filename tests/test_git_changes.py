@@ -0,0 +1,162 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Check that LineMap carries the lines of a newer revision back to an older
+one, from hand written hunks and from the diffs of a scratch repository.
+"""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from dcovr.git_changes import LineMap, get_line_maps, iter_diff_files
+from dcovr.lineset import LineSet
+
+DIFF = '''diff --git src/a.cpp src/a.cpp
+index 1111111..2222222 100644
+--- src/a.cpp
++++ src/a.cpp
+@@ -3,0 +4,2 @@ int f()
+@@ -9,2 +10,0 @@ int g()
+diff --git src/old.cpp src/new.cpp
+similarity index 100%
+rename from src/old.cpp
+rename to src/new.cpp
+diff --git src/added.cpp src/added.cpp
+new file mode 100644
+index 0000000..3333333
+--- /dev/null
++++ src/added.cpp
+@@ -0,0 +1,3 @@
+diff --git src/gone.cpp src/gone.cpp
+deleted file mode 100644
+index 4444444..0000000
+--- src/gone.cpp
++++ /dev/null
+@@ -1,2 +0,0 @@
+'''
+
+OLD = ['int a%d = 0;' % i for i in range(1, 13)]
+
+
+class LineMapTest(unittest.TestCase):
+
+    def test_iter_diff_files(self):
+        self.assertEqual(list(iter_diff_files(DIFF.splitlines(True))), [
+            ('src/a.cpp', 'src/a.cpp', [(3, 0, 4, 2), (9, 2, 10, 0)]),
+            ('src/old.cpp', 'src/new.cpp', []),
+            (None, 'src/added.cpp', [(0, 0, 1, 3)]),
+        ])
+
+    def test_no_hunks(self):
+        carried, unknown = LineMap().map(LineSet([1, 2, 7]))
+        self.assertEqual(carried, LineSet([1, 2, 7]))
+        self.assertEqual(unknown, LineSet())
+
+    def test_insertion(self):
+        # two lines inserted after line 3
+        carried, unknown = LineMap([(3, 0, 4, 2)]).map(LineSet(range(1, 9)))
+        self.assertEqual(unknown, LineSet([4, 5]))
+        self.assertEqual(carried, LineSet([1, 2, 3, 4, 5, 6]))
+
+    def test_pure_deletion(self):
+        # lines 3 and 4 deleted: the hunk sits after line 2 and has no line
+        line_map = LineMap([(3, 2, 2, 0)])
+        self.assertEqual(line_map.map(LineSet([2])), (LineSet([2]), LineSet()))
+        self.assertEqual(line_map.map(LineSet([3, 4])), (LineSet([5, 6]), LineSet()))
+
+    def test_modification(self):
+        # line 5 replaced by two lines, then line 9 deleted
+        line_map = LineMap([(5, 1, 5, 2), (9, 1, 9, 0)])
+        carried, unknown = line_map.map(LineSet(range(1, 13)))
+        self.assertEqual(unknown, LineSet([5, 6]))
+        self.assertEqual(carried, LineSet([1, 2, 3, 4, 6, 7, 8, 10, 11, 12]))
+        self.assertEqual(line_map.map(LineSet([9, 10])), (LineSet([8, 10]), LineSet()))
+
+
+class LineMapRepoTest(unittest.TestCase):
+    """The LineMaps of get_line_maps() from the report commit to HEAD."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='dcovr-test-')
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.git('init', '-q')
+        os.mkdir('src')
+        self.write('src/a.cpp', OLD)
+        self.write('src/b.cpp', OLD)
+        self.commit('report')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(('git',) + args, stdout=devnull)
+
+    def write(self, path, lines):
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def commit(self, message):
+        self.git('add', '-A')
+        self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                 'commit', '-q', '-m', message)
+
+    def line_map(self, f):
+        return get_line_maps('HEAD~1', 'HEAD', [f], ['*.cpp'])[f]
+
+    def check_edit(self, new):
+        # every line of the new revision is carried to the old line with the
+        # same text, if there is one, and is unknown otherwise
+        self.write('src/a.cpp', new)
+        self.commit('edit')
+        line_map = self.line_map('src/a.cpp')
+        self.assertEqual(line_map.old_path, 'src/a.cpp')
+        carried, unknown = line_map.map(LineSet(range(1, len(new) + 1)))
+        self.assertEqual(carried, LineSet(OLD.index(line) + 1 for line in new if line in OLD))
+        self.assertEqual(unknown, LineSet(i for i, line in enumerate(new, 1) if line not in OLD))
+
+    def test_insertions(self):
+        self.check_edit(['int n0;'] + OLD[:3] + ['int n1;', 'int n2;'] + OLD[3:] + ['int n3;'])
+
+    def test_deletions(self):
+        self.check_edit(OLD[1:4] + OLD[6:11])
+
+    def test_modifications(self):
+        self.check_edit(OLD[:4] + ['int m5;'] + OLD[5:8] + ['int m9;', 'int m10;'] + OLD[10:])
+
+    def test_mixed(self):
+        self.check_edit(['int n0;'] + OLD[:2] + OLD[4:6] + ['int m7;'] + OLD[7:9] +
+                        ['int n1;'] + OLD[9:])
+
+    def test_unchanged_file(self):
+        self.check_edit(OLD[1:])
+        line_map = self.line_map('src/b.cpp')
+        self.assertEqual(line_map.old_path, 'src/b.cpp')
+        self.assertEqual(line_map.map(LineSet([1, 12])), (LineSet([1, 12]), LineSet()))
+
+    def test_added_file(self):
+        self.write('src/c.cpp', OLD[:5])
+        self.commit('add')
+        line_map = self.line_map('src/c.cpp')
+        self.assertIsNone(line_map.old_path)
+        self.assertEqual(line_map.map(LineSet(range(1, 6))), (LineSet(), LineSet(range(1, 6))))
+
+    def test_pure_rename(self):
+        self.git('mv', 'src/a.cpp', 'src/renamed.cpp')
+        self.commit('rename')
+        line_map = self.line_map('src/renamed.cpp')
+        self.assertEqual(line_map.old_path, 'src/a.cpp')
+        self.assertEqual(line_map.map(LineSet(range(1, 13))), (LineSet(range(1, 13)), LineSet()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+
+# This file is part of dcovr <https://github.com/yukun89/dcovr>.
+#
+# This software is distributed under the MIT license.
+
+"""
+Check the gate and the json summary of UTCover.create_report, and the
+staged API of UTCover on a scratch git repository.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from dcovr.lineset import LineSet
+from test_gcovr_html import make_page
+
+try:
+    from dcovr.increment_generator import UTCover
+except ImportError:
+    # the commands module is Python 2 only
+    UTCover = None
+
+
+@unittest.skipIf(UTCover is None, 'dcovr.increment_generator needs Python 2')
+class JsonSummaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='dcovr-test-')
+        self.output = os.path.join(self.tmpdir, 'summary.json')
+        self.ut = UTCover('base', 'head', self.tmpdir, 'utcov.', '', 0.2,
+                          output_format='json', output=self.output)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def summary(self, changes, uncovers):
+        self.ut.create_report(changes, uncovers)
+        with open(self.output) as f:
+            return json.load(f)
+
+    def test_coverage(self):
+        summary = self.summary({'src/a.cpp': LineSet(range(1, 101))},
+                               {'src/a.cpp': LineSet(range(1, 44))})
+        self.assertEqual(summary['changed_lines'], 100)
+        self.assertEqual(summary['covered_lines'], 57)
+        self.assertEqual(summary['coverage'], 57.0)
+        self.assertEqual(repr(summary['coverage']), '57.0')
+        self.assertTrue(summary['passed'])
+        self.assertTrue(self.ut.passed)
+
+    def test_below_threshold(self):
+        summary = self.summary({'src/a.cpp': LineSet(range(1, 11))},
+                               {'src/a.cpp': LineSet(range(1, 10))})
+        self.assertEqual(summary['coverage'], 10.0)
+        self.assertFalse(summary['passed'])
+        self.assertFalse(self.ut.passed)
+
+    def test_no_measurable_line(self):
+        # e.g. a range that only changed a README: nothing to cover
+        summary = self.summary({}, {})
+        self.assertEqual(summary['changed_lines'], 0)
+        self.assertEqual(summary['files'], [])
+        self.assertTrue(summary['passed'])
+        self.assertTrue(self.ut.passed)
+
+
+@unittest.skipIf(UTCover is None, 'dcovr.increment_generator needs Python 2')
+class StagedApiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp(prefix='dcovr-test-')
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        os.mkdir('src')
+        self.commit(['int x%d = 0;' % i for i in range(1, 13)], 'base')
+        # lines 3 to 6 changed: 3 covered, 4 and 5 uncovered, 6 not measurable
+        self.commit(['int x%d = 0;' % i if i not in (3, 4, 5, 6) else 'int y%d = 0;' % i
+                     for i in range(1, 13)], 'head')
+        os.mkdir('report')
+        with open(os.path.join('report', 'utcov.foo.cpp.html'), 'w') as f:
+            f.write(make_page())
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+
+    def git(self, *args):
+        with open(os.devnull, 'w') as devnull:
+            subprocess.check_call(('git',) + args, stdout=devnull)
+
+    def commit(self, lines, message):
+        with open(os.path.join('src', 'foo.cpp'), 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        if message == 'base':
+            self.git('init', '-q')
+        self.git('add', 'src/foo.cpp')
+        self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com',
+                 'commit', '-q', '-m', message)
+
+    def test_get_recoverage_info(self):
+        # without check(): get_recoverage_info loads the report index itself
+        ut = UTCover('HEAD~1', 'HEAD', 'report/', 'utcov.', 'src/', 0.2)
+        src_files = ut.get_changed_files()
+        self.assertEqual(src_files, ['src/foo.cpp'])
+        changes = ut.get_changed_lines(src_files)
+        self.assertEqual(changes, {'src/foo.cpp': LineSet([3, 4, 5, 6])})
+        lcov_changes, uncovers = ut.get_recoverage_info(changes)
+        self.assertEqual(lcov_changes, {'src/foo.cpp': LineSet([3, 4, 5])})
+        self.assertEqual(uncovers, {'src/foo.cpp': LineSet([4, 5])})
+        self.assertTrue(os.path.exists(os.path.join('report', 'new_utcov.foo.cpp.html')))
+
+
+if __name__ == '__main__':
+    unittest.main()